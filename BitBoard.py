@@ -0,0 +1,185 @@
+import math
+
+import numpy as np
+
+import board
+from info import Direction, Side
+
+# a plain int, numpy scalars compared to an enum member go through slow attribute lookups
+WHITE = int(Side.WHITE)
+
+
+class BitBoard:
+    # tables depend only on board size, so they are shared by all instances
+    __tables = {}
+
+    def __init__(self, moves):
+        self.size = moves.size
+        self.n_tiles = int(math.pow(self.size, 2) / 2)
+        if self.n_tiles > 64:
+            raise Exception("Bitboards support at most 64 tiles!")
+        if self.size not in BitBoard.__tables:
+            BitBoard.__tables[self.size] = self.__build_tables(moves)
+        (self.bits, self.full, self.shifts, self.sources, self.neighs,
+         self.rays, self.ray_ids, self.steps, self.ray_masks, self.rows) = BitBoard.__tables[self.size]
+        self.white = 0
+        self.black = 0
+        self.kings = 0
+
+    def __build_tables(self, moves):
+        n_tiles = self.n_tiles
+        half = int(self.size / 2)
+        bits = np.array([1 << tile for tile in range(n_tiles)], dtype=np.uint64)
+        full = (1 << n_tiles) - 1
+        board_neighs = board.tables(self.size)[1]
+        neighs = [[None if board_neighs[tile, direction] == -1 else int(board_neighs[tile, direction])
+                   for direction in Direction] for tile in range(n_tiles)]
+        # shift amount and valid source mask for [direction][odd_row]
+        shifts = [[0, 0] for _ in Direction]
+        sources = [[0, 0] for _ in Direction]
+        for tile in range(n_tiles):
+            odd_row = int(tile % self.size >= half)
+            for direction in Direction:
+                neigh = neighs[tile][direction]
+                if neigh is None:
+                    continue
+                shifts[direction][odd_row] = neigh - tile
+                sources[direction][odd_row] |= 1 << tile
+        rays = []
+        ray_ids = []
+        for tile in range(n_tiles):
+            rays.append([])
+            ray_ids.append([])
+            for direction in Direction:
+                rays[-1].append([])
+                ray_ids[-1].append([])
+                length = 1
+                neigh = neighs[tile][direction]
+                while neigh is not None:
+                    rays[-1][-1].append(neigh)
+                    ray_ids[-1][-1].append(moves.move_id.get((tile, direction, length)))
+                    neigh = neighs[neigh][direction]
+                    length += 1
+        # per direction (even row sources, shift, odd row sources, shift, shifts left), all shifts of a direction
+        # point the same way
+        steps = [(sources[direction][0], abs(shifts[direction][0]), sources[direction][1], abs(shifts[direction][1]),
+                  shifts[direction][0] + shifts[direction][1] > 0) for direction in Direction]
+        ray_masks = [[sum(1 << target for target in ray) for ray in tile_rays] for tile_rays in rays]
+        rows = [tile // half for tile in range(n_tiles)]
+        return bits, full, shifts, sources, neighs, rays, ray_ids, steps, ray_masks, rows
+
+    def load(self, game_state):
+        pieces = game_state[:self.n_tiles]
+        self.white = int(np.dot(pieces > 0, self.bits))
+        self.black = int(np.dot(pieces < 0, self.bits))
+        self.kings = int(np.dot(np.abs(pieces) == 2, self.bits))
+
+    def copy(self):
+        bitboard = BitBoard.__new__(BitBoard)
+        bitboard.__dict__.update(self.__dict__)
+        return bitboard
+
+    def put(self, tile, old, new):
+        # keeps the masks in step with one tile of the game state, instead of loading all of them again
+        bit = 1 << tile
+        if old > 0:
+            self.white ^= bit
+        elif old < 0:
+            self.black ^= bit
+        if old == 2 or old == -2:
+            self.kings ^= bit
+        if new > 0:
+            self.white |= bit
+        elif new < 0:
+            self.black |= bit
+        if new == 2 or new == -2:
+            self.kings |= bit
+
+    def step(self, bb, direction):
+        even, even_shift, odd, odd_shift, left = self.steps[direction]
+        if left:
+            return (bb & even) << even_shift | (bb & odd) << odd_shift
+        return (bb & even) >> even_shift | (bb & odd) >> odd_shift
+
+    def generate(self, active_side, active_piece=-1):
+        if active_side == WHITE:
+            own, enemy = self.white, self.black
+            forward = (0, 1)
+        else:
+            own, enemy = self.black, self.white
+            forward = (2, 3)
+        movers = own if active_piece == -1 else own & 1 << int(active_piece)
+        empty = ~(self.white | self.black) & self.full
+        men = movers & ~self.kings
+        kings = movers & self.kings
+
+        takes = {}
+        for direction in range(4):
+            back = 3 - direction
+            landing = self.step(self.step(men, direction) & enemy, direction) & empty
+            while landing:
+                target = (landing & -landing).bit_length() - 1
+                landing &= landing - 1
+                enemy_tile = self.neighs[target][back]
+                takes[self.ray_ids[self.neighs[enemy_tile][back]][direction][1]] = enemy_tile
+        quiet = []
+        occupied = self.white | self.black
+        rows = self.rows
+        while kings:
+            tile = (kings & -kings).bit_length() - 1
+            kings &= kings - 1
+            row = rows[tile]
+            for direction in range(4):
+                move_ids = self.ray_ids[tile][direction]
+                blockers = self.ray_masks[tile][direction] & occupied
+                if not blockers:
+                    quiet.extend(move_ids)
+                    continue
+                # the nearest piece on the ray is the lowest bit going down the board, the highest going up
+                down = direction >= 2
+                first = (blockers & -blockers).bit_length() - 1 if down else blockers.bit_length() - 1
+                distance = abs(rows[first] - row)
+                quiet.extend(move_ids[:distance - 1])
+                if not 1 << first & enemy:
+                    continue
+                # landings run up to the next piece behind the captured one
+                blockers ^= 1 << first
+                if blockers:
+                    second = (blockers & -blockers).bit_length() - 1 if down else blockers.bit_length() - 1
+                    end = abs(rows[second] - row) - 1
+                else:
+                    end = len(move_ids)
+                for move_id in move_ids[distance:end]:
+                    takes[move_id] = first
+        if takes:
+            return sorted(takes), takes
+        if active_piece != -1:
+            return [], takes
+        for direction in forward:
+            back = 3 - direction
+            targets = self.step(men, direction) & empty
+            while targets:
+                target = (targets & -targets).bit_length() - 1
+                targets &= targets - 1
+                quiet.append(self.ray_ids[self.neighs[target][back]][direction][0])
+        quiet.sort()
+        return quiet, takes
+
+    def take_possible_for_tile(self, tile):
+        tile = int(tile)
+        piece = 1 << tile
+        own, enemy = (self.white, self.black) if piece & self.white else (self.black, self.white)
+        empty = ~(self.white | self.black) & self.full
+        if not piece & self.kings:
+            return any(self.step(self.step(piece, direction) & enemy, direction) & empty for direction in range(4))
+        for targets in self.rays[tile]:
+            # the first piece on the ray is an enemy with an empty tile behind it
+            for i, target in enumerate(targets):
+                bit = 1 << target
+                if bit & own:
+                    break
+                if bit & enemy:
+                    if i + 1 < len(targets) and 1 << targets[i + 1] & empty:
+                        return True
+                    break
+        return False
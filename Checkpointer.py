@@ -0,0 +1,45 @@
+import os
+import threading
+
+import torch
+
+
+class Checkpointer:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, "checkpoint.pt")
+        self.saved = 0
+        self.skipped = 0
+        self.__thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, state, memory=None, block=False):
+        # state must be a copy, it is written on a background thread while training goes on;
+        # a save requested while the previous one is still writing is skipped unless block is set
+        if self.__thread is not None and self.__thread.is_alive():
+            if not block:
+                self.skipped += 1
+                return False
+            self.__thread.join()
+        self.__thread = threading.Thread(target=self.__write, args=(state, memory), daemon=True)
+        self.__thread.start()
+        return True
+
+    def wait(self):
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        return torch.load(self.path, map_location="cpu", weights_only=False)
+
+    def __write(self, state, memory):
+        # the replay buffer reaches the disk before the checkpoint that counts its transitions
+        if memory is not None:
+            memory.flush()
+        temporary = self.path + ".tmp"
+        torch.save(state, temporary)
+        os.replace(temporary, self.path)
+        self.saved += 1
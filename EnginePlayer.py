@@ -0,0 +1,76 @@
+import threading
+
+import pygame
+
+from Game import possible_moves
+
+# posted when a move is found, with move and token attributes
+ENGINE_MOVE = pygame.USEREVENT + 1
+
+
+class EnginePlayer:
+
+    def __init__(self, search=None, policy_net=None, think_time=1.0, ponder=True, ponder_time=30.0, max_depth=64):
+        if (search is None) == (policy_net is None):
+            raise Exception("Engine needs exactly one of search or policy_net!")
+        self.search = search
+        self.policy_net = policy_net
+        self.think_time = think_time
+        self.ponder = ponder and search is not None
+        # pondering stops by itself after ponder_time seconds if the opponent takes longer
+        self.ponder_time = ponder_time
+        self.max_depth = max_depth
+        # results carrying an older token were cancelled and are ignored
+        self.token = 0
+        self.thinking = False
+        self.pondering = False
+        # (hash, ply) of the position pondered last, a ponder that ended is not started again for it
+        self.__pondered = None
+        self.__thread = None
+
+    def start_thinking(self, game):
+        self.cancel()
+        self.thinking = True
+        self.__start(self.__think, game.clone(), self.token)
+
+    def start_pondering(self, game):
+        # searches the position on the opponent's time so the transposition table is warm for the reply
+        position = (game.hash, game.ply)
+        if position == self.__pondered:
+            return
+        self.cancel()
+        self.__pondered = position
+        if self.ponder and not game.done:
+            self.pondering = True
+            self.__start(self.__ponder, game.clone(), self.token)
+
+    def cancel(self):
+        self.token += 1
+        self.thinking = False
+        self.pondering = False
+        if self.__thread is not None:
+            # stop again until the thread ends, a search that was only starting clears the flag
+            while self.__thread.is_alive():
+                if self.search is not None:
+                    self.search.stop()
+                self.__thread.join(0.01)
+            self.__thread = None
+
+    def __start(self, target, game, token):
+        self.__thread = threading.Thread(target=target, args=(game, token), daemon=True)
+        self.__thread.start()
+
+    def __think(self, game, token):
+        if self.search is not None:
+            move = self.search.search(game, max_depth=self.max_depth, time_limit=self.think_time)
+        else:
+            # imported here so a search engine does not load torch
+            from Network import greedy_action
+            state = game.game_state
+            move = possible_moves.move(greedy_action(self.policy_net, state, game.legal_mask))
+        pygame.event.post(pygame.event.Event(ENGINE_MOVE, move=move, token=token))
+
+    def __ponder(self, game, token):
+        self.search.search(game, max_depth=self.max_depth, time_limit=self.ponder_time)
+        if token == self.token:
+            self.pondering = False
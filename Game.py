@@ -1,26 +1,34 @@
 import math
-from queue import LifoQueue
 
 import numpy as np
-from Moves import Moves
-from board import get_neigh, on_edge
+import zobrist
+from BitBoard import BitBoard
+from Moves import for_size
+from board import on_edge
 from info import GameParams, Side, side, is_man, is_up
 
-possible_moves = Moves()
+# moves of the standard 8x8 board, games of other sizes use their own, see Game.moves
+possible_moves = for_size(8)
 
 
 class Game:
+    __slots__ = ("done", "max_moves_without_taking", "size", "half", "n_tiles", "starting_rows", "moves", "game_state",
+                 "winner_side", "pieces_left", "ply", "bitboard", "verify_legal", "legal_mask", "legal_moves",
+                 "legal_ids", "legal_updated", "takes", "tablebase", "__keys", "__undo_stack", "__tile_moves",
+                 "__dirty", "__zobrist_pieces", "__zobrist_side", "__zobrist_active")
 
-    def __init__(self, size=8):
-        if size != 8:
-            raise Exception("Only board of size 8 supported now!")
+    def __init__(self, size=8, bitboard=False, verify_legal=False, tablebase=None):
+        # undo records keep tiles in 7 bits and move ids in 12
+        if size % 2 != 0 or not 6 <= size <= 14:
+            raise Exception("Board size must be even and between 6 and 14!")
         self.done = False
         self.max_moves_without_taking = 39
         self.size = size
         self.half = int(size / 2)
-        self.n_tiles = 32
-        self.starting_rows = 3
-        self.game_state = np.zeros((int(math.pow(size, 2) / 2) + len(GameParams),))
+        self.n_tiles = size * size // 2
+        self.starting_rows = (size - 2) // 2
+        self.moves = for_size(size)
+        self.game_state = np.zeros((int(math.pow(size, 2) / 2) + len(GameParams),), dtype=np.int8)
         n_pieces = self.half * self.starting_rows
         self.game_state[:n_pieces] = -1
         self.game_state[-n_pieces - len(GameParams):] = 1
@@ -28,46 +36,143 @@ class Game:
         self.game_state[-1] = 0
         self.game_state[-2] = Side.WHITE
         self.winner_side = 0
-        self.pieces_left = {Side.WHITE: n_pieces, Side.BLACK: n_pieces}
-        self.taken_history = LifoQueue()
-        self.move_history = LifoQueue()
-        possible_moves.update_if_needed(self.size)
+        # indexed by side, black pieces are at -1
+        self.pieces_left = [0, n_pieces, n_pieces]
+        # packed undo records of the moves played so far, see make
+        self.__undo_stack = [0] * 256
+        self.ply = 0
+        self.bitboard = BitBoard(self.moves) if bitboard else None
+        if self.bitboard is not None:
+            self.bitboard.load(self.game_state)
+        self.verify_legal = verify_legal
+        self.tablebase = tablebase
 
-        self.legal_mask = None
-        self.legal_moves = None
+        self.legal_mask = np.zeros((self.moves.n_moves,), dtype=bool)
+        self.legal_moves = []
         self.legal_updated = False
-        self.takes = None
+        self.takes = np.full((self.moves.n_moves,), -1, dtype=int)
+        self.legal_ids = []
+        # per tile cache of (side, is king, quiet move ids, {take move id: enemy tile}), ignoring whose turn it is
+        self.__tile_moves = [(0, False, [], {}) for _ in range(self.n_tiles)]
+        self.__dirty = set(range(self.n_tiles))
+        # hash in the low 64 bits, hash of the position rotated with colours swapped in the high 64 bits
+        self.__zobrist_pieces, self.__zobrist_side, self.__zobrist_active = zobrist.paired_tables(self.n_tiles)
+        self.__keys = zobrist.paired_hash(self.game_state, self.n_tiles)
+
+        self.__update_legal()
+
+    def set_state(self, game_state):
+        self.game_state[:] = game_state
+        if self.bitboard is not None:
+            self.bitboard.load(self.game_state)
+        self.done = False
+        self.winner_side = 0
+        pieces = self.game_state[:self.n_tiles]
+        self.pieces_left = [0, int(np.count_nonzero(pieces > 0)), int(np.count_nonzero(pieces < 0))]
+        self.ply = 0
+        # empty tiles have no moves, only occupied ones need evaluating
+        self.__tile_moves = [(0, False, [], {})] * self.n_tiles
+        self.__dirty = set(np.flatnonzero(pieces).tolist())
+        self.__keys = zobrist.paired_hash(self.game_state, self.n_tiles)
+        self.__update_legal()
+        if len(self.legal_moves) == 0:
+            self.winner_side = -self.game_state[-2]
+            self.end_game()
+
+    def clone(self):
+        game = Game.__new__(Game)
+        game.done = self.done
+        game.max_moves_without_taking = self.max_moves_without_taking
+        game.size = self.size
+        game.half = self.half
+        game.n_tiles = self.n_tiles
+        game.starting_rows = self.starting_rows
+        game.moves = self.moves
+        game.game_state = self.game_state.copy()
+        game.winner_side = self.winner_side
+        game.pieces_left = self.pieces_left.copy()
+        # the history comes along, so ply, move_ids and unmake work on the clone as on the original
+        game.__undo_stack = self.__undo_stack.copy()
+        game.ply = self.ply
+        game.bitboard = None if self.bitboard is None else self.bitboard.copy()
+        game.verify_legal = self.verify_legal
+        game.tablebase = self.tablebase
+        game.legal_mask = self.legal_mask.copy()
+        game.legal_moves = self.legal_moves.copy()
+        game.legal_updated = self.legal_updated
+        game.takes = self.takes.copy()
+        game.__keys = self.__keys
+        game.legal_ids = self.legal_ids
+        # cached tile entries are replaced, never modified, so they can be shared
+        game.__tile_moves = self.__tile_moves.copy()
+        game.__dirty = self.__dirty.copy()
+        game.__zobrist_pieces = self.__zobrist_pieces
+        game.__zobrist_side = self.__zobrist_side
+        game.__zobrist_active = self.__zobrist_active
+        return game
 
+    def snapshot(self):
+        return self.game_state.tobytes(), self.__keys, tuple(self.__tile_moves), frozenset(self.__dirty)
+
+    def restore(self, snapshot):
+        state, self.__keys, tile_moves, dirty = snapshot
+        self.game_state[:] = np.frombuffer(state, dtype=np.int8)
+        if self.bitboard is not None:
+            self.bitboard.load(self.game_state)
+        self.done = False
+        self.winner_side = 0
+        pieces = self.game_state[:self.n_tiles]
+        self.pieces_left = [0, int(np.count_nonzero(pieces > 0)), int(np.count_nonzero(pieces < 0))]
+        self.ply = 0
+        self.__tile_moves = list(tile_moves)
+        self.__dirty = set(dirty)
         self.__update_legal()
+        if len(self.legal_moves) == 0:
+            self.winner_side = -self.game_state[-2]
+            self.end_game()
 
     def perform_move(self, move):
+        move_id = self.moves.move_id.get(move)
+        if move_id is None:
+            return False
+        return self.make(move_id)
+
+    def make(self, move_id):
         if self.done or self.check_game_end():
             return False
-        previous_taken = self.game_state[-1]
-        previous_active = self.game_state[-3]
-        move_id = possible_moves.move_id.get(move)
-        if move_id is None or not self.legal_mask[move_id]:
+        if not self.legal_mask[move_id]:
             return False
-        piece = self.game_state[move[0]]
-        self.game_state[move[0]] = 0
-        target = possible_moves.target(move_id)
-        self.game_state[target] = piece
-        enemy_tile = self.takes[move_id]
+        previous_taken = int(self.game_state[-1])
+        previous_active = int(self.game_state[-3])
+        source = self.moves.sources[move_id]
+        target = self.moves.targets[move_id]
+        piece = self.game_state[source]
+        self.__put(source, 0)
+        self.__put(target, piece)
+        enemy_tile = int(self.takes[move_id])
         if enemy_tile == -1:
+            taken_piece = 0
             self.game_state[-1] += 1
-            self.taken_history.put(None)
         else:
-            self.take_piece(self.takes[move_id])
-        self.game_state[-3] = target
+            taken_piece = int(self.game_state[enemy_tile])
+            self.take_piece(enemy_tile)
+        self.__set_active(target)
         if not self.take_possible_for_tile(target) or enemy_tile == -1:
             self.end_turn()
             turn_ended = True
         else:
             turn_ended = False
-            self.game_state[-3] = target
             self.__update_legal()
         promoted = self.promotion(target)
-        self.move_history.put((move, promoted, turn_ended, previous_active, previous_taken))
+        # bits: move id 0-11, taken tile + 1 12-18, taken piece + 2 19-21, promoted 22, turn ended 23,
+        # previous active piece + 1 24-30, previous moves without taking 31-37
+        record = move_id | (enemy_tile + 1) << 12 | (taken_piece + 2) << 19 | promoted << 22 | turn_ended << 23 \
+            | (previous_active + 1) << 24 | previous_taken << 31
+        if self.ply == len(self.__undo_stack):
+            self.__undo_stack.extend([0] * self.ply)
+        self.__undo_stack[self.ply] = record
+        self.ply += 1
+        return True
 
     def check_game_end(self):
         if len(self.legal_moves) == 0:
@@ -79,7 +184,34 @@ class Game:
             return True
         return False
 
+    @property
+    def hash(self):
+        return self.__keys & zobrist.mask
+
+    @property
+    def mirrored_hash(self):
+        return self.__keys >> 64
+
+    def canonical_hash(self):
+        # same key for a position and its rotated, colour swapped twin
+        return self.__keys & zobrist.mask if self.game_state[-2] == Side.WHITE else self.__keys >> 64
+
+    def probe(self):
+        # exact (value for the side to move, distance) from the endgame tablebase, None if not covered
+        if self.tablebase is None or self.done:
+            return None
+        return self.tablebase.probe(self.game_state)
+
     def check_move(self, move):
+        valid = self.__check_path(move)
+        if valid and self.game_state[-3] != -1 and valid[1] is None:  # Move invalid: Cannot move after taking
+            return False
+        return valid
+
+    def __check_path(self, move):
+        move_id = self.moves.move_id.get(move)
+        if move_id is None:  # Move invalid: Invalid target
+            return False
         source = move[0]
         piece = self.game_state[source]
         direction = move[1]
@@ -90,28 +222,120 @@ class Game:
                 return False
             elif length == 1 and (my_side == 1) ^ is_up(direction):  # Move invalid: Invalid direction for man
                 return False
-        target = source
         enemy_tile = None
-        for _ in range(length):
-            target = get_neigh(self.size, target, direction)
-            if target is None or side(self.game_state[target]) == my_side:  # Move invalid: Invalid target or occupied friendly piece in path
+        for tile in self.moves.path(move_id):
+            if self.game_state[tile] == 0:
+                continue
+            if side(self.game_state[tile]) == my_side:  # Move invalid: Occupied friendly piece in path
+                return False
+            if enemy_tile is not None:  # Move invalid: More than 1 enemy in path
                 return False
-            if self.game_state[target] != 0:
-                if enemy_tile is not None:  # Move invalid: More than 1 enemy in path
-                    return False
-                enemy_tile = target
-        if self.game_state[target] != 0:  # Move invalid: Target not empty
+            enemy_tile = tile
+        if self.game_state[self.moves.target(move_id)] != 0:  # Move invalid: Target not empty
             return False
         if is_man(piece) and length == 2 and enemy_tile is None:  # Move invalid: Man cannot jump over empty
             return False
-        if self.game_state[-3] != -1 and enemy_tile is None:  # Move invalid: Cannot move after taking
-            return False
         return True, enemy_tile
 
+    def __put(self, tile, piece):
+        self.__keys ^= self.__zobrist_pieces[tile][int(self.game_state[tile]) + 2] ^ self.__zobrist_pieces[tile][int(piece) + 2]
+        if self.bitboard is not None:
+            self.bitboard.put(tile, int(self.game_state[tile]), int(piece))
+        self.game_state[tile] = piece
+        self.__touch(tile)
+
+    def __set_active(self, tile):
+        self.__keys ^= self.__zobrist_active[int(self.game_state[-3]) + 1] ^ self.__zobrist_active[int(tile) + 1]
+        self.game_state[-3] = tile
+
+    def __touch(self, tile):
+        self.__dirty.update(self.moves.crossing_men[tile])
+        for other in self.moves.crossing_kings[tile]:
+            if self.__tile_moves[other][1]:
+                self.__dirty.add(other)
+
+    def __evaluate_tile(self, tile, pieces):
+        piece = pieces[tile]
+        man = piece == 1 or piece == -1
+        quiet = []
+        takes = {}
+        if piece != 0:
+            targets = self.moves.targets
+            for direction, up, ray in self.moves.tile_rays[tile]:
+                enemy_tile = None
+                # walk the ray outwards and stop as soon as it is blocked
+                for move_id in ray[:2] if man else ray:
+                    target = targets[move_id]
+                    other = pieces[target]
+                    if other * piece > 0 or (other != 0 and enemy_tile is not None):
+                        break
+                    if other != 0:
+                        enemy_tile = target
+                    elif enemy_tile is not None:
+                        takes[move_id] = enemy_tile
+                    elif not man or (move_id == ray[0] and (piece > 0) == up):
+                        quiet.append(move_id)
+        self.__tile_moves[tile] = (side(piece), not man and piece != 0, quiet, takes)
+
+    def __refresh_tiles(self, only_tile=None):
+        # pieces of the side not to move stay dirty until their moves are needed
+        active_side = self.game_state[-2]
+        pieces = self.game_state[:self.n_tiles].tolist()
+        refreshed = []
+        for tile in self.__dirty if only_tile is None else self.__dirty & {only_tile}:
+            piece = pieces[tile]
+            if piece * active_side < 0 and tile != only_tile:
+                self.__tile_moves[tile] = (-active_side, piece != 1 and piece != -1, [], {})
+                continue
+            self.__evaluate_tile(tile, pieces)
+            refreshed.append(tile)
+        self.__dirty.difference_update(refreshed)
+
     def __update_legal(self):
-        no_take_mask = np.zeros((possible_moves.n_moves, ), dtype=bool)
-        take_mask = np.zeros((possible_moves.n_moves, ), dtype=bool)
-        self.takes = np.full((possible_moves.n_moves,), -1, dtype=int)
+        if self.bitboard is not None:
+            self.__update_legal_bitboard()
+        else:
+            self.__update_legal_incremental()
+        if self.verify_legal:
+            self.__verify_legal()
+
+    def __update_legal_incremental(self):
+        self.__refresh_tiles()
+        active_side = self.game_state[-2]
+        active_piece = int(self.game_state[-3])
+        tiles = range(self.n_tiles) if active_piece == -1 else (active_piece,)
+        quiet = []
+        takes = {}
+        for tile in tiles:
+            tile_side, _, tile_quiet, tile_takes = self.__tile_moves[tile]
+            if tile_side != active_side:
+                continue
+            if tile_takes:
+                takes.update(tile_takes)
+            elif not takes and active_piece == -1:
+                quiet.extend(tile_quiet)
+        self.__set_legal(list(takes) if takes else quiet, takes)
+
+    def __set_legal(self, move_ids, takes):
+        self.legal_mask[self.legal_ids] = False
+        self.takes[self.legal_ids] = -1
+        self.legal_mask[move_ids] = True
+        for move_id, enemy_tile in takes.items():
+            self.takes[move_id] = enemy_tile
+        self.legal_ids = move_ids
+        self.legal_moves = [self.moves.move(move_id) for move_id in move_ids]
+        self.legal_updated = True
+
+    def __verify_legal(self):
+        legal_moves, legal_mask, takes = self.__rebuild_legal()
+        if legal_moves != self.legal_moves or not np.array_equal(legal_mask, self.legal_mask) \
+                or not np.array_equal(takes[legal_mask], self.takes[self.legal_mask]):
+            raise Exception("Legal moves differ from full rebuild!")
+
+    def __rebuild_legal(self):
+        no_take_mask = np.zeros((self.moves.n_moves, ), dtype=bool)
+        take_mask = np.zeros((self.moves.n_moves, ), dtype=bool)
+        takes = np.full((self.moves.n_moves,), -1, dtype=int)
         legal_no_take = []
         legal_take = []
         take_possible = False
@@ -121,46 +345,41 @@ class Game:
                 continue
             if self.game_state[-3] != -1 and self.game_state[-3] != tile:
                 continue
-            for move in possible_moves.moves(tile, man=is_man(piece)):
+            for move in self.moves.moves(tile, man=is_man(piece)):
                 valid = self.check_move(move)
                 if not valid:
                     continue
                 take = valid[1]
                 if take_possible and take is None:
                     continue
-                move_id = possible_moves.move_id.get(move)
+                move_id = self.moves.move_id.get(move)
                 if take is not None:
                     take_possible = True
                     take_mask[move_id] = True
-                    self.takes[move_id] = take
+                    takes[move_id] = take
                     legal_take.append(move)
                 else:
                     legal_no_take.append(move)
                     no_take_mask[move_id] = True
         if take_possible:
-            self.legal_moves = legal_take
-            self.legal_mask = take_mask
-        else:
-            self.legal_moves = legal_no_take
-            self.legal_mask = no_take_mask
-        self.legal_updated = True
+            return legal_take, take_mask, takes
+        return legal_no_take, no_take_mask, takes
+
+    def __update_legal_bitboard(self):
+        move_ids, takes = self.bitboard.generate(self.game_state[-2], self.game_state[-3])
+        self.__set_legal(move_ids, takes)
 
     def take_possible_for_tile(self, tile):
-        for move in possible_moves.moves(tile, man=is_man(self.game_state[tile])):
-            valid = self.check_move(move)
-            if not valid:
-                continue
-            take = valid[1]
-            if take:
-                return True
-        return False
+        if self.bitboard is not None:
+            return self.bitboard.take_possible_for_tile(tile)
+        self.__refresh_tiles(only_tile=tile)
+        return len(self.__tile_moves[tile][3]) > 0
 
     def take_piece(self, tile):
         piece_side = side(self.game_state[tile])
         if piece_side == 0:
             return False
-        self.taken_history.put((tile, self.game_state[tile]))
-        self.game_state[tile] = 0
+        self.__put(tile, 0)
         self.game_state[-1] = 0
         pieces_left = self.pieces_left[piece_side]
         pieces_left -= 1
@@ -170,49 +389,59 @@ class Game:
         self.pieces_left[piece_side] = pieces_left
         return True
 
+    def move_ids(self):
+        # moves played since the game was created or its state was set
+        return [record & 0xfff for record in self.__undo_stack[:self.ply]]
+
     def undo_move(self):
-        if self.move_history.empty():
+        self.unmake()
+
+    def unmake(self):
+        if self.ply == 0:
             return
-        move_data = self.move_history.get()
-        move = move_data[0]
-        source = move[0]
-        target = source
-        for _ in range(move[2]):
-            target = get_neigh(self.size, target, move[1])
-        self.game_state[source] = self.game_state[target]
-        self.game_state[target] = 0
-        taken = self.taken_history.get()
-        if taken is not None:
-            self.game_state[taken[0]] = taken[1]
-            self.pieces_left[side(taken[1])] += 1
-        if move_data[1]:  # undo promotion
+        self.ply -= 1
+        record = self.__undo_stack[self.ply]
+        move_id = record & 0xfff
+        source = self.moves.sources[move_id]
+        target = self.moves.targets[move_id]
+        self.__put(source, self.game_state[target])
+        self.__put(target, 0)
+        enemy_tile = (record >> 12 & 0x7f) - 1
+        if enemy_tile != -1:
+            taken_piece = (record >> 19 & 0x7) - 2
+            self.__put(enemy_tile, taken_piece)
+            self.pieces_left[side(taken_piece)] += 1
+        if record >> 22 & 1:  # undo promotion
             self.depromote(source)
-        if move_data[2]:  # undo turn end
-            self.end_turn()
-        self.game_state[-3] = move_data[3]
-        self.game_state[-1] = move_data[4]
+        if record >> 23 & 1:  # undo turn end
+            self.game_state[-2] *= -1
+            self.__keys ^= self.__zobrist_side
+        self.__set_active((record >> 24 & 0x7f) - 1)
+        self.game_state[-1] = record >> 31
         self.done = False
+        self.winner_side = 0
         self.__update_legal()
 
     def promotion(self, tile):
         if self.game_state[tile] == 1 and on_edge(self.size, tile, 3):
-            self.game_state[tile] = 2
+            self.__put(tile, 2)
             return True
         elif self.game_state[tile] == -1 and on_edge(self.size, tile, 1):
-            self.game_state[tile] = -2
+            self.__put(tile, -2)
             return True
         else:
             return False
 
     def depromote(self, tile):
         if self.game_state[tile] == -2:
-            self.game_state[tile] = -1
+            self.__put(tile, -1)
         elif self.game_state[tile] == 2:
-            self.game_state[tile] = 1
+            self.__put(tile, 1)
 
     def end_turn(self):
         self.game_state[-2] *= -1
-        self.game_state[-3] = -1
+        self.__keys ^= self.__zobrist_side
+        self.__set_active(-1)
         self.__update_legal()
         if len(self.legal_moves) == 0:
             self.winner_side = -self.game_state[-2]
@@ -220,8 +449,7 @@ class Game:
 
     def end_game(self):
         self.done = True
-        self.legal_moves = []
-        self.legal_mask = np.zeros((possible_moves.n_moves,), dtype=bool)
+        self.__set_legal([], {})
 
     def active_piece(self):
         return self.game_state[-3]
@@ -0,0 +1,251 @@
+import argparse
+import glob
+import os
+import re
+import threading
+
+import numpy as np
+
+from Game import Game
+from Moves import for_size
+from info import Side
+
+magic = b"CHKGA002"
+# shards start with the magic and the board size (int64); shards of the first version hold 8x8 games only
+magic_v1 = b"CHKGA001"
+shard_header = len(magic) + 8
+# every game: number of moves (uint16), result as the winner side (int8), padding byte, then the move ids (uint16)
+record_header = 4
+
+# PDN squares are tiles + 1, numbered from the top left like the tiles; white starts at the bottom and moves first
+pdn_results = {Side.WHITE: "1-0", Side.BLACK: "0-1", 0: "1/2-1/2"}
+pdn_result_sides = {"1-0": Side.WHITE, "2-0": Side.WHITE, "0-1": Side.BLACK, "0-2": Side.BLACK,
+                    "1/2-1/2": 0, "1-1": 0, "0-0": 0, "*": 0}
+
+
+class ArchiveWriter:
+
+    def __init__(self, directory, prefix="games", shard_size=1 << 26, size=8):
+        self.directory = directory
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.size = size
+        self.games = 0
+        self.__lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # every session starts a new shard, the last one may end in a game cut off by a crash;
+        # other prefixes belong to other writers
+        shards = shard_paths(directory, prefix)
+        self.__index = int(shards[-1][-9:-4]) + 1 if shards else 0
+        self.__file = None
+        self.__open()
+
+    def write(self, move_ids, result):
+        move_ids = np.asarray(move_ids, dtype=np.uint16)
+        if len(move_ids) > np.iinfo(np.uint16).max:
+            raise Exception("Game too long for the archive!")
+        header = np.array([len(move_ids)], dtype=np.uint16).tobytes() + np.array([result, 0], dtype=np.int8).tobytes()
+        with self.__lock:
+            self.__file.write(header)
+            self.__file.write(move_ids.tobytes())
+            self.games += 1
+            if self.__file.tell() >= self.shard_size:
+                self.__file.close()
+                self.__index += 1
+                self.__open()
+
+    def flush(self):
+        with self.__lock:
+            self.__file.flush()
+
+    def close(self):
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __open(self):
+        path = os.path.join(self.directory, "{}-{:05d}.bin".format(self.prefix, self.__index))
+        self.__file = open(path, "xb")
+        self.__file.write(magic + np.array([self.size], dtype=np.int64).tobytes())
+
+
+def shard_paths(directory, prefix="*"):
+    return sorted(glob.glob(os.path.join(directory, "{}-[0-9][0-9][0-9][0-9][0-9].bin".format(prefix))))
+
+
+def shard_size(path):
+    # board size of the games in a shard
+    with open(path, "rb") as file:
+        header = file.read(shard_header)
+    if header[:len(magic_v1)] == magic_v1:
+        return 8
+    if header[:len(magic)] != magic or len(header) < shard_header:
+        raise Exception("Not a game archive shard: {}!".format(path))
+    return int(np.frombuffer(header[len(magic):], dtype=np.int64)[0])
+
+
+def read_shard(path, size=8):
+    # (move ids, result) for every complete game, move ids are views into the memory-mapped shard
+    if shard_size(path) != size:
+        raise Exception("Shard {} holds games of board size {}, not {}!".format(path, shard_size(path), size))
+    data = np.memmap(path, dtype=np.uint8, mode="r").view(np.ndarray)
+    position = len(magic_v1) if data[:len(magic_v1)].tobytes() == magic_v1 else shard_header
+    while position + record_header <= len(data):
+        n_moves = int(data[position:position + 2].view(np.uint16)[0])
+        result = int(data[position + 2:position + 3].view(np.int8)[0])
+        start = position + record_header
+        stop = start + 2 * n_moves
+        if stop > len(data):
+            break  # game cut off by an interrupted write
+        yield data[start:stop].view(np.uint16), result
+        position = stop
+
+
+def read_games(directory, prefix="*", size=8):
+    for path in shard_paths(directory, prefix):
+        yield from read_shard(path, size)
+
+
+def replay(move_ids, size=8):
+    # the game before each of its moves, one Game is reused so copy what must be kept
+    game = Game(size)
+    for move_id in move_ids:
+        yield game, int(move_id)
+        if not game.make(int(move_id)):
+            raise Exception("Illegal move {} in archived game!".format(int(move_id)))
+
+
+def positions(directory, prefix="*", size=8):
+    for move_ids, result in read_games(directory, prefix, size):
+        for game, move_id in replay(move_ids, size):
+            yield game.game_state, move_id, result
+
+
+def turns(move_ids, size=8):
+    # (move ids, is take) for every turn, multi-captures are one turn
+    game = Game(size)
+    turn = []
+    for move_id in move_ids:
+        mover = game.game_state[-2]
+        take = game.takes[int(move_id)] != -1
+        turn.append(int(move_id))
+        if not game.make(int(move_id)):
+            raise Exception("Illegal move {}!".format(int(move_id)))
+        if game.game_state[-2] != mover or game.done:
+            yield turn, take
+            turn = []
+    if turn:
+        yield turn, take
+
+
+def to_pdn(move_ids, result, tags=None, size=8):
+    tags = {"Event": "?", **(tags or {}), "Result": pdn_results[result]}
+    lines = ['[{} "{}"]'.format(name, value) for name, value in tags.items()]
+    tokens = []
+    moves = for_size(size)
+    for i, (turn, take) in enumerate(turns(move_ids, size)):
+        separator = "x" if take else "-"
+        squares = [moves.sources[turn[0]] + 1] + [moves.targets[move_id] + 1 for move_id in turn]
+        token = separator.join(str(square) for square in squares)
+        tokens.append("{}. {}".format(i // 2 + 1, token) if i % 2 == 0 else token)
+    tokens.append(pdn_results[result])
+    lines.append(" ".join(tokens))
+    return "\n".join(lines) + "\n"
+
+
+def from_pdn(text, size=8):
+    # (move ids, result) for every game in the text
+    text = re.sub(r"\{[^}]*\}", " ", text)
+    games = []
+    game = Game(size)
+    move_ids = []
+    started = False
+    for token in re.findall(r"\[[^\]]*\]|\S+", text):
+        if token.startswith("["):
+            if started:
+                games.append((move_ids, 0))
+                game, move_ids, started = Game(size), [], False
+            continue
+        if token in pdn_result_sides:
+            games.append((move_ids, pdn_result_sides[token]))
+            game, move_ids, started = Game(size), [], False
+            continue
+        token = re.sub(r"^\d+\.+", "", token)
+        if not token:
+            continue
+        started = True
+        squares = [int(square) - 1 for square in re.split("[-x]", token)]
+        for source, target in zip(squares, squares[1:]):
+            path = __find_moves(game, source, target)
+            if path is None:
+                raise Exception("Illegal PDN move {}!".format(token))
+            for move_id in path:
+                game.make(move_id)
+                move_ids.append(move_id)
+    if started:
+        games.append((move_ids, 0))
+    return games
+
+
+def __find_moves(game, source, target, mover=None):
+    # a legal move from source to target, or a chain of takes when the intermediate squares were left out
+    mover = game.game_state[-2] if mover is None else mover
+    for move_id in game.legal_ids:
+        if game.moves.sources[move_id] == source and game.moves.targets[move_id] == target:
+            return [move_id]
+    for move_id in list(game.legal_ids):
+        if game.moves.sources[move_id] != source or game.takes[move_id] == -1:
+            continue
+        game.make(move_id)
+        rest = __find_moves(game, game.moves.targets[move_id], target, mover) \
+            if game.game_state[-2] == mover and not game.done else None
+        game.unmake()
+        if rest is not None:
+            return [move_id] + rest
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and convert game archives")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    stats_parser = subparsers.add_parser("stats")
+    stats_parser.add_argument("directory")
+    export_parser = subparsers.add_parser("export")
+    export_parser.add_argument("directory")
+    export_parser.add_argument("pdn")
+    export_parser.add_argument("--limit", type=int, default=None)
+    import_parser = subparsers.add_parser("import")
+    import_parser.add_argument("pdn")
+    import_parser.add_argument("directory")
+    for subparser in (stats_parser, export_parser, import_parser):
+        subparser.add_argument("--size", type=int, default=8, help="board size of the games")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        games = 0
+        plies = 0
+        results = {Side.WHITE: 0, Side.BLACK: 0, 0: 0}
+        for move_ids, result in read_games(args.directory, size=args.size):
+            games += 1
+            plies += len(move_ids)
+            results[result] += 1
+        print("{} games, {} plies, white {} black {} draws {}".format(
+            games, plies, results[Side.WHITE], results[Side.BLACK], results[0]))
+    elif args.command == "export":
+        with open(args.pdn, "w") as file:
+            for i, (move_ids, result) in enumerate(read_games(args.directory, size=args.size)):
+                if args.limit is not None and i >= args.limit:
+                    break
+                file.write(to_pdn(move_ids, result, {"Round": i + 1}, args.size) + "\n")
+    else:
+        with open(args.pdn) as file, ArchiveWriter(args.directory, "imported", size=args.size) as writer:
+            for move_ids, result in from_pdn(file.read(), args.size):
+                writer.write(move_ids, result)
+        print("imported {} games".format(writer.games))
@@ -1,40 +1,67 @@
 import gymnasium as gym
 from gymnasium import spaces
 
-from Game import Game, possible_moves
+from Game import Game
+from canonical import canonical_states, canonical_masks, move_permutation
 
 
 class GameEnv(gym.Env):
     metadata = {"render_modes": ["human", "rgb_array"], "render_fps": 4}
 
-    def __init__(self, render_mode=None, size=8):
+    def __init__(self, render_mode=None, size=8, tablebase=None, canonical=False):
         self.size = size
-        self.game = Game(size)
+        self.tablebase = tablebase
+        # observations, masks and actions from the point of view of the side to move, see canonical
+        self.canonical = canonical
+        self.game = Game(size, tablebase=tablebase)
+        # result of the finished episode, including endgames decided by the tablebase
+        self.winner_side = 0
         self.observation_space = spaces.Discrete(len(self.game.game_state))
-        self.action_space = spaces.Discrete(possible_moves.n_moves)
+        self.action_space = spaces.Discrete(self.game.moves.n_moves)
         assert render_mode is None or render_mode in self.metadata["render_modes"]
         self.render_mode = render_mode
 
     def reset(self, seed=None, options=None):
-        self.game = Game(self.size)
-        observation = self.game.game_state
+        self.game = Game(self.size, tablebase=self.tablebase)
+        self.winner_side = 0
+        observation = self.__observation()
         info = None
         if self.render_mode == "human":
             self._render_frame()
         return observation, info
 
+    def legal_mask(self):
+        if self.canonical:
+            return canonical_masks(self.game.legal_mask, self.game.active_side() != 1, self.game.moves)
+        return self.game.legal_mask
+
+    def __observation(self):
+        return canonical_states(self.game.game_state) if self.canonical else self.game.game_state
+
     def step(self, action):
-        valid = self.game.perform_move(possible_moves.move(action))
-        if self.game.winner_side is not None:
-            reward = 1
-        elif not valid:
+        mover = self.game.active_side()
+        if self.canonical and mover != 1:
+            action = move_permutation(self.game.moves)[action]
+        valid = self.game.perform_move(self.game.moves.move(action))
+        if not valid:
             reward = -1
+        elif self.game.done and self.game.winner_side == mover:
+            reward = 1
         else:
             reward = 0
+        # endgames covered by the tablebase end the episode with their exact result
+        result = self.game.probe() if valid else None
+        if result is not None and result[0] == -1 and self.game.active_side() != mover:
+            reward = 1
+        if self.game.done:
+            self.winner_side = self.game.winner_side
+        elif result is not None:
+            self.winner_side = self.game.active_side() * result[0]
 
-        observation = self.game.game_state
+        observation = self.__observation()
         info = None
-        terminated = self.game.done or not valid
+        terminated = self.game.done or not valid or self.game.last_take() > self.game.max_moves_without_taking \
+            or result is not None
 
         if self.render_mode == "human":
             self._render_frame()
@@ -1,16 +1,16 @@
 import math
 import random
 
-import numpy as np
 import pygame
 
 import board
+from EnginePlayer import ENGINE_MOVE
 from Game import Game, possible_moves
 from info import Direction, side, Pieces, is_man, Side
 
 
 class GameMaster:
-    def __init__(self):
+    def __init__(self, engine=None, engine_side=Side.BLACK):
         self.white_piece_color = (248, 248, 248)
         self.black_piece_color = (84, 84, 84)
         self.selected_color = (244, 62, 65)
@@ -26,6 +26,14 @@ class GameMaster:
         self.buttons = []
         self.game = None
         self.last_clicked = None
+        # pre-rendered board, tiles and pieces; drawn holds what each tile shows so only changes are redrawn
+        self.board_surface = None
+        self.tile_surfaces = {}
+        self.piece_surfaces = {}
+        self.drawn = []
+        # EnginePlayer answering for engine_side, None for two humans
+        self.engine = engine
+        self.engine_side = engine_side
 
     def init_buttons(self):
         x = self.top_left[0]
@@ -43,28 +51,90 @@ class GameMaster:
                 last_empty = True
             x += self.tile_size
 
+    def init_surfaces(self):
+        self.board_surface = pygame.Surface(self.screen.get_size())
+        self.board_surface.fill((255, 255, 255))
+        self.draw_board(self.board_surface, pieces=False)
+        for selected in (False, True):
+            surface = pygame.Surface((self.tile_size, self.tile_size))
+            surface.fill(self.selected_color if selected else self.black_tile_color)
+            self.tile_surfaces[selected] = surface
+        for piece in Pieces:
+            surface = pygame.Surface((self.tile_size, self.tile_size), pygame.SRCALPHA)
+            self.draw_piece(piece, self.tile_size // 2, self.tile_size // 2, surface)
+            self.piece_surfaces[piece] = surface
+        self.drawn = [None] * len(self.buttons)
+
     def new_game(self):
         self.game = Game()
         self.init_buttons()
+        self.init_surfaces()
+        self.redraw()
         running = True
-        clock = pygame.time.Clock()
         while running:
-            for event in pygame.event.get():
+            # sleep until something happens instead of redrawing every frame
+            for event in [pygame.event.wait()] + pygame.event.get():
                 if event.type == pygame.QUIT:
                     running = False
-                if event.type == pygame.MOUSEBUTTONDOWN:
+                if event.type == pygame.MOUSEBUTTONDOWN and not self.engine_to_move():
                     self.on_click()
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_z:
-                        self.game.undo_move()
-            self.screen.fill((255, 255, 255))
-            self.draw_board()
-            pygame.display.flip()
-            clock.tick(40)
+                        self.undo()
+                if event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE):
+                    self.redraw()
+                if event.type == ENGINE_MOVE and self.engine is not None and event.token == self.engine.token:
+                    self.engine.thinking = False
+                    if event.move is not None:
+                        self.game.perform_move(event.move)
+            if running:
+                self.update_board()
+                self.engine_turn()
+        if self.engine is not None:
+            self.engine.cancel()
         pygame.quit()
 
+    def engine_to_move(self):
+        return self.engine is not None and not self.game.done and self.game.active_side() == self.engine_side
+
+    def engine_turn(self):
+        if self.engine is None or self.engine.thinking:
+            return
+        if self.engine_to_move():
+            self.engine.start_thinking(self.game)
+        elif not self.engine.pondering:
+            self.engine.start_pondering(self.game)
+
+    def undo(self):
+        if self.engine is None:
+            self.game.undo_move()
+            return
+        # take back the engine's reply together with the move it answered
+        self.engine.cancel()
+        self.game.undo_move()
+        while self.game.ply > 0 and self.game.active_side() == self.engine_side:
+            self.game.undo_move()
+
+    def redraw(self):
+        self.screen.blit(self.board_surface, (0, 0))
+        self.drawn = [None] * len(self.buttons)
+        self.update_board()
+        pygame.display.flip()
+
+    def update_board(self):
+        dirty = []
+        for tile, button in enumerate(self.buttons):
+            shown = (int(self.game.game_state[tile]), self.last_clicked == tile)
+            if shown == self.drawn[tile]:
+                continue
+            self.screen.blit(self.tile_surfaces[shown[1]], button)
+            self.screen.blit(self.piece_surfaces[shown[0]], button)
+            self.drawn[tile] = shown
+            dirty.append(button)
+        if dirty:
+            pygame.display.update(dirty)
+
     def on_click(self):
-        print(np.count_nonzero(self.game.legal_mask))
         pos = pygame.mouse.get_pos()
         for i, button in enumerate(self.buttons):
             if button.collidepoint(pos):
@@ -98,7 +168,7 @@ class GameMaster:
     def reset_clicked(self):
         self.last_clicked = None
 
-    def draw_board(self):
+    def draw_board(self, surface, pieces=True):
         x = self.top_left[0]
         y = self.top_left[1] - self.tile_size
         last_empty = True
@@ -109,22 +179,22 @@ class GameMaster:
                 last_empty = not last_empty
             if last_empty:
                 color = self.selected_color if self.last_clicked == int(i / 2) else self.black_tile_color
-                pygame.draw.rect(self.screen, color, pygame.Rect(x, y, self.tile_size, self.tile_size))
+                pygame.draw.rect(surface, color, pygame.Rect(x, y, self.tile_size, self.tile_size))
                 piece_x = x + int(self.tile_size / 2)
                 piece_y = y + int(self.tile_size / 2)
-                piece = self.game.game_state[int(i / 2)]
-                self.draw_piece(piece, piece_x, piece_y)
+                if pieces:
+                    self.draw_piece(self.game.game_state[int(i / 2)], piece_x, piece_y, surface)
                 last_empty = False
             else:
-                pygame.draw.rect(self.screen, self.white_tile_color, pygame.Rect(x, y, self.tile_size, self.tile_size))
+                pygame.draw.rect(surface, self.white_tile_color, pygame.Rect(x, y, self.tile_size, self.tile_size))
                 last_empty = True
             x += self.tile_size
 
-    def draw_piece(self, piece, x, y):
+    def draw_piece(self, piece, x, y, surface):
         if piece == Pieces.EMPTY:
             return 
         color = self.white_piece_color if side(piece) == Side.WHITE else self.black_piece_color
         if is_man(piece):
-            pygame.draw.circle(self.screen, color, [x, y], self.piece_radius)
+            pygame.draw.circle(surface, color, [x, y], self.piece_radius)
         else:
-            pygame.draw.circle(self.screen, color, [x, y], self.piece_radius, self.king_radius)
+            pygame.draw.circle(surface, color, [x, y], self.piece_radius, self.king_radius)
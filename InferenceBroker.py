@@ -0,0 +1,114 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+
+
+class InferenceBroker:
+
+    def __init__(self, net, batch_size=64, max_latency=0.002, device=None, forward=None):
+        self.net = net
+        # run on each batch instead of the network itself, e.g. a method returning more outputs
+        self.forward = forward or net
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.device = device or next(net.parameters()).device
+        self.requests = queue.Queue()
+        # held while the network runs, take it to change the weights between batches
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.served = 0
+        self.__states = None
+        self.__thread = None
+        self.__stopped = False
+
+    def start(self):
+        self.__stopped = False
+        self.__thread = threading.Thread(target=self.__serve, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__stopped = True
+        self.requests.put(None)
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        # requests queued behind the sentinel or racing with stop would otherwise wait forever
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                request[2].set_exception(Exception("Inference broker stopped!"))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def submit(self, state, legal_mask=None):
+        # resolves to the chosen legal action when a mask is given, otherwise to the raw network output
+        if self.__stopped:
+            raise Exception("Inference broker stopped!")
+        future = Future()
+        self.requests.put((state, legal_mask, future))
+        return future
+
+    def select_action(self, state, legal_mask):
+        return self.submit(state, legal_mask).result()
+
+    def __collect(self):
+        request = self.requests.get()
+        if request is None:
+            return []
+        batch = [request]
+        deadline = time.perf_counter() + self.max_latency
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self.__stopped = True
+                break
+            batch.append(request)
+        return batch
+
+    def __serve(self):
+        while not self.__stopped:
+            batch = self.__collect()
+            if not batch:
+                continue
+            try:
+                results = self.__run(batch)
+            except Exception as exception:
+                # a bad request fails its batch, the broker keeps serving
+                for _, _, future in batch:
+                    future.set_exception(exception)
+                continue
+            for (_, _, future), result in zip(batch, results):
+                future.set_result(result)
+            self.batches += 1
+            self.served += len(batch)
+
+    def __run(self, batch):
+        n = len(batch)
+        if self.__states is None or self.__states.shape[1] != len(batch[0][0]):
+            self.__states = torch.zeros((self.batch_size, len(batch[0][0])))
+        states = self.__states[:n]
+        states.copy_(torch.from_numpy(np.stack([state for state, _, _ in batch]).astype(np.float32)))
+        with self.lock, torch.no_grad():
+            out = self.forward(states.to(self.device)).cpu()
+        masked = [i for i, (_, legal_mask, _) in enumerate(batch) if legal_mask is not None]
+        actions = {}
+        if masked:
+            masks = torch.from_numpy(np.stack([batch[i][1] for i in masked]))
+            actions = dict(zip(masked, out[masked].masked_fill(~masks, float('-inf')).argmax(1).tolist()))
+        return [out[i] if legal_mask is None else actions[i] for i, (_, legal_mask, _) in enumerate(batch)]
@@ -1,22 +1,35 @@
+import argparse
+import copy
 import math
+import os
 import random
+import threading
+import time
 from itertools import count
 
+import numpy as np
 import torch
 from torch import nn
 
-from Game import possible_moves
+import instrument
+from canonical import canonical_actions
+from Checkpointer import Checkpointer
 from Network import Network
 from GameEnv import GameEnv
 import torch.optim as optim
-import matplotlib.pyplot as plt
-from ReplayMemory import ReplayMemory, Transition
-from IPython import display
+from MetricsSink import MetricsSink
+from ReplayMemory import ReplayMemory
+from PrioritizedReplayMemory import PrioritizedReplayMemory
+from Scheduler import Scheduler
+from SelfPlay import SelfPlay
+from Tablebase import Tablebase
+from OpeningBook import OpeningBook
+from GameArchive import ArchiveWriter
 
 
 class Learn:
 
-    def __init__(self):
+    def __init__(self, size=8, tablebase_path=None, book_path=None, canonical=False, augment=False):
         self.BATCH_SIZE = 16
         self.GAMMA = 0.99
         self.EPS_START = 0.9
@@ -25,27 +38,59 @@ class Learn:
         self.TAU = 0.005
         self.LR = 1e-3
         self.MEM_SIZE = 10000
+        # samples transitions by TD error instead of uniformly, beta rises to 1 over PER_BETA_UPDATES updates;
+        # switch it on with use_prioritized_replay, which replaces the buffer
+        self.PRIORITIZED_REPLAY = False
+        self.PER_ALPHA = 0.6
+        self.PER_BETA_START = 0.4
+        self.PER_BETA_UPDATES = 100000
+        # 8 for the standard board, 10 for international draughts; the networks are built for it below
+        self.BOARD_SIZE = size
+        # built with Tablebase.py, endgames it covers end episodes early with the exact result
+        self.TABLEBASE_PATH = tablebase_path
+        # built with OpeningBook.py, its moves are played instead of the policy in the first plies
+        self.OPENING_BOOK_PATH = book_path
+        # states seen from the side to move, which halves the positions to learn; flips augment absolute states instead
+        self.CANONICAL_STATES = canonical
+        self.AUGMENT_FLIPS = augment
+        # directory the played games are appended to, see GameArchive
+        self.ARCHIVE_DIR = None
+        # directory for episode and step metrics written on a background thread, plot them with plot_metrics.py
+        self.METRICS_DIR = None
+        self.METRICS_FORMAT = "jsonl"
+        self.LOG_EVERY = 100
+        # directory for checkpoints written in the background every CHECKPOINT_EVERY updates, training resumes
+        # from it; the replay buffer is kept there in memory-mapped files. Set by use_checkpoints
+        self.CHECKPOINT_DIR = None
+        self.CHECKPOINT_EVERY = 1000
 
         self.durations = []
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.env = GameEnv()
-        n_actions = possible_moves.n_moves  # remove
+        self.tablebase = Tablebase.load(self.TABLEBASE_PATH) if self.TABLEBASE_PATH else None
+        self.book = OpeningBook.load(self.OPENING_BOOK_PATH) if self.OPENING_BOOK_PATH else None
+        self.env = GameEnv(size=self.BOARD_SIZE, tablebase=self.tablebase, canonical=self.CANONICAL_STATES)
+        n_actions = self.env.game.moves.n_moves
         state, info = self.env.reset()
         n_observations = len(state)
         self.policy_net = Network(n_observations, n_actions).to(self.device)
         self.target_net = Network(n_observations, n_actions).to(self.device)
         self.target_net.load_state_dict(self.policy_net.state_dict())
         self.optimizer = optim.AdamW(self.policy_net.parameters(), lr=self.LR, amsgrad=True)
-        self.memory = ReplayMemory(self.MEM_SIZE)
+        self.memory = self.__make_memory(n_observations)
+        # guards memory when acting and learning run on different threads
+        self.memory_lock = threading.Lock()
         self.steps_done = 0
-        plt.ion()
+        self.updates = 0
+        self.episode_metrics = None
+        self.step_metrics = None
+        self.checkpointer = None
 
-    def select_action(self, state, legal_mask=None):
+    def select_action(self, state, legal_mask=None, net=None):
         eps_threshold = self.EPS_END + (self.EPS_START - self.EPS_END) * math.exp(-1. * self.steps_done / self.EPS_DECAY)
         self.steps_done += 1
         if random.random() > eps_threshold:
             with torch.no_grad():
-                out = self.policy_net(state)
+                out = (net or self.policy_net)(state)
                 if legal_mask is not None:
                     legal_mask = torch.unsqueeze(torch.from_numpy(legal_mask), 0)
                     out[legal_mask == False] = float('-inf')  # sus
@@ -56,19 +101,16 @@ class Learn:
     def optimize_model(self):
         if len(self.memory) < self.BATCH_SIZE:
             return
-        transitions = self.memory.sample(self.BATCH_SIZE)
-        batch = Transition(*zip(*transitions))
-
-        # Compute a mask of non-final states and concatenate the batch elements
-        # (a final state would've been the one after which simulation ended)
-        non_final_mask = torch.tensor(tuple(map(lambda s: s is not None, batch.next_state)), device=self.device, dtype=torch.bool)
-        next = [s for s in batch.next_state if s is not None]
-        if not next:
-            return
-        non_final_next_states = torch.cat(next)
-        state_batch = torch.cat(batch.state)
-        action_batch = torch.cat(batch.action)
-        reward_batch = torch.cat(batch.reward)
+        prioritized = isinstance(self.memory, PrioritizedReplayMemory)
+        with self.memory_lock:
+            if prioritized:
+                self.memory.beta = min(1., self.PER_BETA_START + (1 - self.PER_BETA_START) * self.updates / self.PER_BETA_UPDATES)
+            batch = self.memory.sample(self.BATCH_SIZE)
+        state_batch = batch.state.to(self.device)
+        action_batch = batch.action.to(self.device)
+        next_state_batch = batch.next_state.to(self.device)
+        reward_batch = batch.reward.to(self.device)
+        done_batch = batch.done.to(self.device)
 
         # Compute Q(s_t, a) - the model computes Q(s_t), then we select the
         # columns of actions taken. These are the actions which would've been taken
@@ -76,19 +118,27 @@ class Learn:
         state_action_values = self.policy_net(state_batch).gather(1, action_batch)
 
         # Compute V(s_{t+1}) for all next states.
-        # Expected values of actions for non_final_next_states are computed based
+        # Expected values of actions for next states are computed based
         # on the "older" target_net; selecting their best reward with max(1)[0].
-        # This is merged based on the mask, such that we'll have either the expected
+        # Final states are masked out, such that we'll have either the expected
         # state value or 0 in case the state was final.
-        next_state_values = torch.zeros(self.BATCH_SIZE, device=self.device)
         with torch.no_grad():
-            next_state_values[non_final_mask] = self.target_net(non_final_next_states).max(1)[0]
+            next_state_values = self.target_net(next_state_batch).max(1)[0]
+            next_state_values[done_batch] = 0
         # Compute the expected Q values
         expected_state_action_values = (next_state_values * self.GAMMA) + reward_batch
 
         # Compute Huber loss
-        criterion = nn.SmoothL1Loss()
-        loss = criterion(state_action_values, expected_state_action_values.unsqueeze(1))
+        if prioritized:
+            # weighted by importance sampling, the TD errors become the new priorities
+            losses = nn.functional.smooth_l1_loss(state_action_values.squeeze(1), expected_state_action_values, reduction="none")
+            loss = (losses * batch.weight.to(self.device)).mean()
+            errors = (state_action_values.squeeze(1) - expected_state_action_values).detach().abs().cpu().numpy()
+            with self.memory_lock:
+                self.memory.update_priorities(batch.index, errors)
+        else:
+            criterion = nn.SmoothL1Loss()
+            loss = criterion(state_action_values, expected_state_action_values.unsqueeze(1))
 
         # Optimize the model
         self.optimizer.zero_grad()
@@ -96,39 +146,181 @@ class Learn:
         # In-place gradient clipping
         torch.nn.utils.clip_grad_value_(self.policy_net.parameters(), 100)
         self.optimizer.step()
+        self.updates += 1
+        if self.step_metrics is not None and self.updates % self.LOG_EVERY == 0:
+            self.step_metrics.write({"update": self.updates, "loss": loss.item(), "steps_done": self.steps_done,
+                                     "time": time.time()})
+        if self.checkpointer is not None and self.updates % self.CHECKPOINT_EVERY == 0:
+            self.save_checkpoint()
+
+    def use_checkpoints(self, directory):
+        # moves the replay buffer to the checkpoint directory and resumes from the checkpoint there, if any
+        if len(self.memory) > 0:
+            raise Exception("Call use_checkpoints before collecting transitions, the replay buffer is replaced!")
+        self.CHECKPOINT_DIR = directory
+        self.checkpointer = Checkpointer(directory)
+        with self.memory_lock:
+            self.memory = self.__make_memory(self.memory.states.shape[1], os.path.join(directory, "replay"))
+        return self.load_checkpoint()
+
+    def use_prioritized_replay(self):
+        # replaces the replay buffer with a prioritized one holding the transitions collected so far
+        self.PRIORITIZED_REPLAY = True
+        with self.memory_lock:
+            old = self.memory
+            if isinstance(old, PrioritizedReplayMemory):
+                return
+            self.memory = self.__make_memory(old.states.shape[1], old.path)
+            if len(old) > 0:
+                # oldest first; indexing copies, so a buffer on the same files does not overwrite what it reads
+                order = (old.position - len(old) + np.arange(len(old))) % old.capacity
+                self.memory.push_batch(old.states[order], old.actions[order], old.next_states[order],
+                                       old.rewards[order], old.dones[order])
+
+    def __make_memory(self, n_observations, path=None):
+        if self.PRIORITIZED_REPLAY:
+            return PrioritizedReplayMemory(self.MEM_SIZE, n_observations, augment=self.AUGMENT_FLIPS, alpha=self.PER_ALPHA,
+                                           beta=self.PER_BETA_START, moves=self.env.game.moves, path=path)
+        return ReplayMemory(self.MEM_SIZE, n_observations, augment=self.AUGMENT_FLIPS, moves=self.env.game.moves,
+                            path=path)
+
+    def save_checkpoint(self, wait=False):
+        # copied here so the background write sees the state of one moment, only the copy pauses training
+        with self.memory_lock:
+            memory = self.memory.state_dict()
+        state = {
+            "policy_net": copy.deepcopy(self.policy_net.state_dict()),
+            "target_net": copy.deepcopy(self.target_net.state_dict()),
+            "optimizer": copy.deepcopy(self.optimizer.state_dict()),
+            "steps_done": self.steps_done,
+            "updates": self.updates,
+            "durations": list(self.durations),
+            "memory": memory,
+        }
+        self.checkpointer.save(state, self.memory, block=wait)
+        if wait:
+            self.checkpointer.wait()
+
+    def load_checkpoint(self):
+        state = self.checkpointer.load()
+        if state is None:
+            return False
+        self.policy_net.load_state_dict(state["policy_net"])
+        self.target_net.load_state_dict(state["target_net"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        self.steps_done = state["steps_done"]
+        self.updates = state["updates"]
+        self.durations = state["durations"]
+        with self.memory_lock:
+            self.memory.load_state_dict(state["memory"])
+        return True
+
+    def close_checkpoints(self):
+        if self.checkpointer is not None:
+            self.save_checkpoint(wait=True)
+
+    def open_metrics(self):
+        if self.METRICS_DIR is None or self.episode_metrics is not None:
+            return
+        os.makedirs(self.METRICS_DIR, exist_ok=True)
+        self.episode_metrics = MetricsSink(os.path.join(self.METRICS_DIR, "episodes." + self.METRICS_FORMAT))
+        self.step_metrics = MetricsSink(os.path.join(self.METRICS_DIR, "steps." + self.METRICS_FORMAT))
+
+    def close_metrics(self):
+        for sink in (self.episode_metrics, self.step_metrics):
+            if sink is not None:
+                sink.close()
+        self.episode_metrics = None
+        self.step_metrics = None
+
+    def end_episode(self, duration, reward):
+        self.durations.append(duration)
+        if self.episode_metrics is not None:
+            self.episode_metrics.write({"episode": len(self.durations), "duration": duration, "reward": float(reward),
+                                        "updates": self.updates, "time": time.time()})
 
     def learn(self, n_episodes, plot_training=True):
-        self.durations = []
+        self.open_metrics()
+        archive = ArchiveWriter(self.ARCHIVE_DIR, "learn", size=self.BOARD_SIZE) if self.ARCHIVE_DIR else None
         for i in range(n_episodes):
             state, info = self.env.reset()
-            state = torch.tensor(state, dtype=torch.float32, device=self.device).unsqueeze(0)
+            state = np.array(state)
+            episode_reward = 0
             for t in count():
-                action = self.select_action(state, legal_mask=self.env.game.legal_moves_mask())
-                observation, reward, terminated, truncated, _ = self.env.step(action.item())
-                reward = torch.tensor([reward], device=self.device)
-                if terminated:
-                    next_state = None
+                book_move = None if self.book is None else self.book.choose(self.env.game)
+                if book_move is not None:
+                    if self.CANONICAL_STATES:
+                        book_move = int(canonical_actions(book_move, self.env.game.active_side() != 1, self.env.game.moves))
+                    action = torch.tensor([[book_move]], device=self.device, dtype=torch.long)
                 else:
-                    next_state = torch.tensor(observation, dtype=torch.float32, device=self.device).unsqueeze(0)
-                self.memory.push(state, action, next_state, reward)
-                state = next_state
+                    action = self.select_action(torch.tensor(state, dtype=torch.float32, device=self.device).unsqueeze(0),
+                                                legal_mask=self.env.legal_mask())
+                observation, reward, terminated, truncated, _ = self.env.step(action.item())
+                self.memory.push(state, action.item(), None if terminated else observation, reward)
+                episode_reward += reward
+                state = np.array(observation)
                 self.optimize_model()
-                target_net_state = self.target_net.state_dict()
-                policy_net_state = self.policy_net.state_dict()
-                for key in policy_net_state:
-                    target_net_state[key] = policy_net_state[key] * self.TAU + target_net_state[key] * (1 - self.TAU)
-                self.target_net.load_state_dict(target_net_state)
+                self.update_target()
                 if terminated or truncated:
-                    self.durations.append(t + 1)
+                    if archive is not None:
+                        archive.write(self.env.game.move_ids(), self.env.winner_side)
+                    self.end_episode(t + 1, episode_reward)
                     if plot_training:
                         self.plot_durations()
                     break
+        if archive is not None:
+            archive.close()
+        self.close_metrics()
+        self.close_checkpoints()
+        print('Complete')
+        if instrument.enabled:
+            print(instrument.format_report(instrument.snapshot()))
+        if plot_training:
+            self.plot_durations(show_result=True)
+
+    def update_target(self):
+        # target = target + TAU * (policy - target), in place
+        with torch.no_grad():
+            for target, policy in zip(self.target_net.parameters(), self.policy_net.parameters()):
+                target.lerp_(policy, self.TAU)
+
+    def learn_self_play(self, n_updates, n_workers=None, sync_every=100, games_per_worker=1, plot_training=True):
+        self_play = SelfPlay(self.policy_net, n_workers, eps=(self.EPS_START, self.EPS_END, self.EPS_DECAY),
+                             games_per_worker=games_per_worker, tablebase_path=self.TABLEBASE_PATH,
+                             book_path=self.OPENING_BOOK_PATH, canonical=self.CANONICAL_STATES,
+                             archive_dir=self.ARCHIVE_DIR, size=self.BOARD_SIZE)
+        self_play.start()
+        self.open_metrics()
+        try:
+            for update in range(n_updates):
+                # wait for workers only until there is enough data to learn from
+                episodes = self_play.episodes_ready(block=len(self.memory) < self.BATCH_SIZE)
+                for episode in episodes:
+                    self.push_episode(*episode)
+                if episodes and plot_training:
+                    self.plot_durations()
+                self.optimize_model()
+                self.update_target()
+                if (update + 1) % sync_every == 0:
+                    self_play.sync(self.policy_net)
+        finally:
+            self_play.stop()
+            self.close_metrics()
+            self.close_checkpoints()
         print('Complete')
-        self.plot_durations(show_result=True)
-        plt.ioff()
-        plt.show()
+        if instrument.enabled:
+            print(instrument.format_report(instrument.snapshot()))
+
+    def push_episode(self, states, actions, next_states, rewards, dones):
+        with self.memory_lock:
+            self.memory.push_batch(states, actions, next_states, rewards, dones)
+        self.end_episode(len(actions), rewards.sum())
 
     def plot_durations(self, show_result=False):
+        # imported here so headless training never loads a plotting backend
+        import matplotlib.pyplot as plt
+        from IPython import display
+        plt.ion()
         plt.figure(1)
         durations_t = torch.tensor(self.durations, dtype=torch.float)
         if show_result:
@@ -152,8 +344,38 @@ class Learn:
             display.clear_output(wait=True)
         else:
             display.display(plt.gcf())
+            plt.ioff()
+            plt.show()
 
 
 if __name__ == "__main__":
-    l = Learn()
-    l.learn(1000, plot_training=True)
+    parser = argparse.ArgumentParser(description="Train the policy network")
+    parser.add_argument("--episodes", type=int, default=1000)
+    parser.add_argument("--size", type=int, default=8, help="board size, 10 for international draughts")
+    parser.add_argument("--tablebase", default=None, help="tablebase built with Tablebase.py")
+    parser.add_argument("--book", default=None, help="opening book built with OpeningBook.py")
+    parser.add_argument("--canonical", action="store_true", help="states seen from the side to move")
+    parser.add_argument("--augment", action="store_true", help="samples transitions rotated with colours swapped too")
+    parser.add_argument("--headless", action="store_true", help="no plots, metrics go to --metrics-dir")
+    parser.add_argument("--metrics-dir", default=None)
+    parser.add_argument("--checkpoint-dir", default=None, help="saves checkpoints there and resumes from the last one")
+    parser.add_argument("--prioritized", action="store_true", help="prioritized experience replay")
+    parser.add_argument("--updates", type=int, default=None,
+                        help="acts and learns on separate threads for this many updates instead of --episodes")
+    parser.add_argument("--self-play", action="store_true", help="with --updates, plays in worker processes")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    l = Learn(size=args.size, tablebase_path=args.tablebase, book_path=args.book, canonical=args.canonical,
+              augment=args.augment)
+    l.METRICS_DIR = args.metrics_dir
+    if args.prioritized:
+        l.use_prioritized_replay()
+    if args.checkpoint_dir is not None and l.use_checkpoints(args.checkpoint_dir):
+        print("Resumed at update {} with {} transitions".format(l.updates, len(l.memory)))
+    if args.updates is not None and args.self_play:
+        l.learn_self_play(args.updates, n_workers=args.workers, plot_training=not args.headless)
+    elif args.updates is not None:
+        Scheduler(l).run(args.updates)
+    else:
+        l.learn(args.episodes, plot_training=not args.headless)
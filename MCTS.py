@@ -0,0 +1,360 @@
+import argparse
+import math
+import threading
+import time
+
+import numpy as np
+import torch
+
+from Game import Game
+from InferenceBroker import InferenceBroker
+from canonical import flip_states, move_permutation
+from info import Side
+
+# first child of a node that was not evaluated yet, or whose evaluation is in flight
+UNEXPANDED = -1
+PENDING = -2
+
+
+class MCTS:
+    # node fields, children of a node are stored next to each other
+    fields = {
+        "parents": np.int32,
+        "move_ids": np.int16,
+        "priors": np.float32,
+        "visits": np.int32,
+        "values": np.float32,  # sum of results for the side that made the move into the node
+        "virtual": np.int32,  # selections still waiting for their evaluation
+        "children": np.int32,
+        "n_children": np.int32,
+        "to_move": np.int8,
+        "outcomes": np.float32,  # exact result for the side to move, NaN while the game goes on
+    }
+
+    def __init__(self, net, simulations=800, n_threads=8, c_puct=1.5, virtual_loss=1., canonical=False,
+                 tablebase=None, noise=0., dirichlet_alpha=0.3, capacity=1 << 16, use_value=False):
+        self.net = net
+        # Learn does not train the value head yet, so by default leaves count as draws and the search is led by the
+        # priors, terminal positions and tablebase results; set use_value once the head is trained
+        self.use_value = use_value
+        self.simulations = simulations
+        self.n_threads = n_threads
+        self.c_puct = c_puct
+        self.virtual_loss = virtual_loss
+        # the network sees positions from the side to move, as trained with Learn.CANONICAL_STATES
+        self.canonical = canonical
+        self.tablebase = tablebase
+        # dirichlet noise mixed into the root priors for variety in self-play
+        self.noise = noise
+        self.dirichlet_alpha = dirichlet_alpha
+        self.rng = np.random.default_rng()
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.simulations_done = 0
+        self.collisions = 0
+        self.evaluations = 0
+        self.__broker = None
+        self.__error = None
+        self.__move_flip = None
+        # a clone of the searched game, and a game of the same size that leaves are set up on
+        self.__root = None
+        self.__template = None
+        self.__allocate(capacity)
+        self.size = 0
+
+    def __allocate(self, capacity, state_size=35):
+        for name, dtype in self.fields.items():
+            setattr(self, name, np.zeros((capacity,), dtype=dtype))
+        # game state of every evaluated node, its children are expanded from a game set to it
+        self.states = np.zeros((capacity, state_size), dtype=np.int8)
+
+    def __reserve(self, n):
+        start = self.size
+        self.size += n
+        if self.size > len(self.parents):
+            capacity = max(2 * len(self.parents), self.size)
+            for name in self.fields:
+                old = getattr(self, name)
+                new = np.zeros((capacity,), dtype=old.dtype)
+                new[:start] = old[:start]
+                setattr(self, name, new)
+            states = np.zeros((capacity, self.states.shape[1]), dtype=np.int8)
+            states[:start] = self.states[:start]
+            self.states = states
+        end = self.size
+        self.visits[start:end] = 0
+        self.values[start:end] = 0
+        self.virtual[start:end] = 0
+        self.children[start:end] = UNEXPANDED
+        self.n_children[start:end] = 0
+        self.outcomes[start:end] = np.nan
+        return start
+
+    def search(self, game, simulations=None, time_limit=None):
+        # most visited move as (tile, direction, length), like Search.search
+        if game.done or len(game.legal_ids) == 0:
+            return None
+        self.stopped = False
+        self.__error = None
+        self.simulations_done = 0
+        self.collisions = 0
+        self.__set_root(game)
+        if self.n_children[0] == 0:
+            return None
+        if self.noise > 0 and self.n_children[0] > 0:
+            start, end = self.children[0], self.children[0] + self.n_children[0]
+            noise = self.rng.dirichlet([self.dirichlet_alpha] * (end - start))
+            self.priors[start:end] = (1 - self.noise) * self.priors[start:end] + self.noise * noise
+        target = self.simulations if simulations is None else simulations
+        deadline = None if time_limit is None else time.perf_counter() + time_limit
+        if self.n_threads > 1:
+            self.__broker = InferenceBroker(self.net, batch_size=self.n_threads, max_latency=0.001,
+                                            forward=self.net.evaluate).start()
+            threads = [threading.Thread(target=self.__run, args=(target, deadline), daemon=True)
+                       for _ in range(self.n_threads)]
+            for thread in threads:
+                thread.start()
+            try:
+                for thread in threads:
+                    thread.join()
+            finally:
+                self.stopped = True
+                self.__broker.stop()
+                self.__broker = None
+        else:
+            self.__run(target, deadline)
+        if self.__error is not None:
+            self.size = 0
+            raise self.__error
+        return game.moves.move(self.best_move_id())
+
+    def stop(self):
+        self.stopped = True
+
+    def best_move_id(self):
+        start, end = self.children[0], self.children[0] + self.n_children[0]
+        return int(self.move_ids[start + int(np.argmax(self.visits[start:end]))])
+
+    def policy(self, n_moves):
+        # visit distribution over the moves of the root, a training target for the policy
+        policy = np.zeros((n_moves,), dtype=np.float32)
+        start, end = self.children[0], self.children[0] + self.n_children[0]
+        visits = self.visits[start:end]
+        if visits.sum() > 0:
+            policy[self.move_ids[start:end]] = visits / visits.sum()
+        return policy
+
+    def choose(self, temperature=1., rng=None):
+        # move id drawn by visits ** (1 / temperature), the most visited one at temperature 0
+        if temperature == 0:
+            return self.best_move_id()
+        rng = rng or self.rng
+        start, end = self.children[0], self.children[0] + self.n_children[0]
+        weights = self.visits[start:end].astype(np.float64) ** (1 / temperature)
+        if weights.sum() == 0:
+            weights = self.priors[start:end].astype(np.float64)
+        return int(self.move_ids[start + rng.choice(end - start, p=weights / weights.sum())])
+
+    def __set_root(self, game):
+        # keeps the subtree of a position reached from the old root, e.g. after our move and the reply
+        state = game.game_state.tobytes()
+        self.__root = game.clone()
+        if self.__template is None or self.__template.size != game.size:
+            # bitboards set up a position from its state the fastest
+            self.__template = Game(game.size, bitboard=game.n_tiles <= 64)
+        if self.size > 0 and self.states.shape[1] == len(state):
+            frontier = [0]
+            for _ in range(4):
+                for node in frontier:
+                    if self.children[node] >= 0 and self.states[node].tobytes() == state:
+                        if node != 0:
+                            self.__reroot(node)
+                        return
+                frontier = [child for node in frontier if self.children[node] >= 0
+                            for child in range(self.children[node], self.children[node] + self.n_children[node])]
+        if self.states.shape[1] != len(state):
+            self.__allocate(len(self.parents), len(state))
+        self.size = 0
+        self.__reserve(1)
+        self.parents[0] = -1
+        self.move_ids[0] = -1
+        self.priors[0] = 1
+        # the root is searched even when the tablebase knows its result, a move is still needed
+        root = game.clone()
+        if not root.check_game_end():
+            priors, value = self.__evaluate(root)
+            self.__expand(0, root, priors)
+
+    def __reroot(self, node):
+        # copies the subtree into fresh arrays with the node as the root, children stay next to each other
+        old = {name: getattr(self, name) for name in self.fields}
+        old_states = self.states
+        self.__allocate(len(self.parents), old_states.shape[1])
+        self.size = 0
+        self.__reserve(1)
+        copies = [(node, 0)]
+        for old_node, new_node in copies:
+            for name in self.fields:
+                getattr(self, name)[new_node] = old[name][old_node]
+            self.states[new_node] = old_states[old_node]
+            first = old["children"][old_node]
+            if first < 0:
+                continue
+            n = int(old["n_children"][old_node])
+            start = self.__reserve(n)
+            self.children[new_node] = start
+            copies.extend(zip(range(first, first + n), range(start, start + n)))
+        for _, new_node in copies:
+            first = self.children[new_node]
+            if first >= 0:
+                self.parents[first:first + self.n_children[new_node]] = new_node
+        self.parents[0] = -1
+
+    def __run(self, target, deadline):
+        try:
+            while not self.stopped and self.simulations_done < target:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                self.__simulate()
+        except Exception as exception:
+            # a failed evaluation leaves its leaf pending, stop the other threads and raise it in search
+            self.stopped = True
+            self.__error = exception
+
+    def __simulate(self):
+        with self.lock:
+            path = self.__select()
+            leaf = path[-1]
+            if not np.isnan(self.outcomes[leaf]):
+                self.__backup(path, self.outcomes[leaf], self.to_move[leaf])
+                return
+            if self.children[leaf] == PENDING:
+                # another thread is evaluating this leaf, give the virtual loss back and select again
+                self.virtual[path] -= 1
+                self.collisions += 1
+                return
+            self.children[leaf] = PENDING
+            state, move_ids = self.__position(leaf)
+        if state is None:
+            game = self.__root.clone()
+        else:
+            game = self.__template.clone()
+            game.set_state(state)
+        for move_id in move_ids:
+            game.make(move_id)
+        outcome = self.__outcome(game)
+        priors, value = (None, outcome) if outcome is not None else self.__evaluate(game)
+        with self.lock:
+            self.to_move[leaf] = game.active_side()
+            if outcome is not None:
+                self.outcomes[leaf] = outcome
+                self.children[leaf] = UNEXPANDED
+            else:
+                self.__expand(leaf, game, priors)
+            self.__backup(path, value, self.to_move[leaf])
+
+    def __select(self):
+        node = 0
+        path = [0]
+        self.virtual[0] += 1
+        while self.children[node] >= 0:
+            start = self.children[node]
+            end = start + self.n_children[node]
+            virtual = self.virtual[start:end]
+            visits = self.visits[start:end] + virtual
+            # puct, with pending selections counted as losses so other threads spread out
+            scale = self.c_puct * math.sqrt(max(int(self.visits[node] + self.virtual[node]), 1))
+            score = (self.values[start:end] - self.virtual_loss * virtual) / np.maximum(visits, 1) \
+                + scale * self.priors[start:end] / (1 + visits)
+            node = start + int(score.argmax())
+            self.virtual[node] += 1
+            path.append(node)
+        return path
+
+    def __expand(self, node, game, priors):
+        n = len(priors)
+        start = self.__reserve(n)
+        self.parents[start:start + n] = node
+        self.move_ids[start:start + n] = game.legal_ids
+        self.priors[start:start + n] = priors
+        self.children[node] = start
+        self.n_children[node] = n
+        self.to_move[node] = game.active_side()
+        self.states[node] = game.game_state
+
+    def __position(self, leaf):
+        # state to set a game to, None for the root, and the moves from there to the leaf; in the middle of a capture
+        # the state does not tell that a man crowned on the way goes on capturing as a man, so the turn is replayed
+        move_ids = [int(self.move_ids[leaf])]
+        node = self.parents[leaf]
+        while node != 0 and self.states[node, -3] != -1:
+            move_ids.append(int(self.move_ids[node]))
+            node = self.parents[node]
+        return None if node == 0 else self.states[node].copy(), move_ids[::-1]
+
+    def __backup(self, path, value, side):
+        # value is for side; every node collects it for the side that moved into it
+        path = np.array(path)
+        self.visits[path] += 1
+        self.virtual[path] -= 1
+        nodes = path[1:]
+        movers = self.to_move[self.parents[nodes]]
+        self.values[nodes] += np.where(movers == side, value, -value)
+        self.simulations_done += 1
+
+    def __outcome(self, game):
+        # exact result for the side to move, None while the game goes on
+        if game.done or game.check_game_end():
+            return float(game.winner_side * game.active_side())
+        if self.tablebase is not None:
+            result = self.tablebase.probe(game.game_state)
+            if result is not None:
+                return float(result[0])
+        return None
+
+    def __evaluate(self, game):
+        # (softmax of the network outputs over the legal moves, value for the side to move)
+        state = game.game_state
+        flip = self.canonical and state[-2] != Side.WHITE
+        if flip:
+            state = flip_states(state)
+        if self.__broker is not None:
+            out = self.__broker.submit(state).result()
+        else:
+            with torch.no_grad():
+                device = next(self.net.parameters()).device
+                out = self.net.evaluate(torch.from_numpy(state.astype(np.float32)).to(device)).cpu()
+        out = out.numpy()
+        self.evaluations += 1
+        legal = game.legal_ids
+        if flip:
+            if self.__move_flip is None or len(self.__move_flip) != game.moves.n_moves:
+                self.__move_flip = move_permutation(game.moves)
+            legal = self.__move_flip[legal]
+        logits = out[legal]
+        priors = np.exp(logits - logits.max())
+        return priors / priors.sum(), float(out[-1]) if self.use_value else 0.
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure MCTS simulations per second with an untrained network")
+    parser.add_argument("--simulations", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--moves", type=int, default=10)
+    args = parser.parse_args()
+
+    from Network import Network
+
+    torch.set_num_threads(1)
+    game = Game()
+    net = Network(len(game.game_state), game.moves.n_moves)
+    mcts = MCTS(net, simulations=args.simulations, n_threads=args.threads)
+    for _ in range(args.moves):
+        if game.done:
+            break
+        start = time.perf_counter()
+        move = mcts.search(game)
+        elapsed = time.perf_counter() - start
+        print("{} {:.0f} simulations/s, {} nodes, {} collisions".format(
+            move, mcts.simulations_done / elapsed, mcts.size, mcts.collisions))
+        game.perform_move(move)
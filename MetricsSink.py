@@ -0,0 +1,51 @@
+import csv
+import json
+import queue
+import threading
+
+
+class MetricsSink:
+
+    def __init__(self, path, flush_every=1.0):
+        # rows are written on a background thread; a .csv path writes CSV with the first row's keys, anything else JSONL
+        self.path = path
+        self.flush_every = flush_every
+        self.csv = path.endswith(".csv")
+        self.rows = queue.SimpleQueue()
+        self.written = 0
+        self.__thread = threading.Thread(target=self.__write, daemon=True)
+        self.__thread.start()
+
+    def write(self, row):
+        self.rows.put(row)
+
+    def close(self):
+        self.rows.put(None)
+        self.__thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __write(self):
+        with open(self.path, "a", newline="") as file:
+            writer = None
+            while True:
+                try:
+                    row = self.rows.get(timeout=self.flush_every)
+                except queue.Empty:
+                    file.flush()
+                    continue
+                if row is None:
+                    break
+                if not self.csv:
+                    file.write(json.dumps(row) + "\n")
+                else:
+                    if writer is None:
+                        writer = csv.DictWriter(file, fieldnames=list(row), extrasaction="ignore")
+                        if file.tell() == 0:
+                            writer.writeheader()
+                    writer.writerow(row)
+                self.written += 1
@@ -12,34 +12,51 @@ class Moves:
         self.n_moves = -1
         self.move_id = {}
         self.id_move = {}
+        self.sources = []
         self.targets = []
+        self.paths = []
+        self.rays = []
+        self.tile_rays = []
+        self.crossing_men = []
+        self.crossing_kings = []
 
     def update_if_needed(self, size):
         if self.size == size:
             return
         self.size = size
+        moves, targets, rays = board.move_tables(size)
         n_tiles = int(math.pow(size, 2) / 2)
-        i = 0
-        for tile in range(n_tiles):
-            self.man_moves.append([])
-            self.all_moves.append([])
-            for direction in info.Direction:
-                neigh = tile
-                length = 0
-                while True:
-                    neigh = board.get_neigh(size, neigh, direction)
-                    length += 1
-                    if neigh is None:
-                        break
-                    move = (tile, direction, length)
-                    if length <= 2:
-                        self.man_moves[-1].append(move)
-                    self.all_moves[-1].append(move)
-                    self.move_id[move] = i
-                    self.id_move[i] = move
-                    self.targets.append(neigh)
-                    i += 1
-        self.n_moves = i
+        # python lists, indexing them is cheaper than indexing the memory-mapped arrays in the hot paths
+        self.sources = moves[:, 0].tolist()
+        self.targets = targets.tolist()
+        self.n_moves = len(self.targets)
+        self.man_moves = [[] for _ in range(n_tiles)]
+        self.all_moves = [[] for _ in range(n_tiles)]
+        self.tile_rays = [[] for _ in range(n_tiles)]
+        self.move_id = {}
+        self.id_move = {}
+        self.paths = []
+        self.rays = []
+        # tiles whose moves pass through or land on tile, split by whether a man could make the move
+        self.crossing_men = [{tile} for tile in range(n_tiles)]
+        self.crossing_kings = [set() for _ in range(n_tiles)]
+        for i, (tile, direction, length) in enumerate(moves.tolist()):
+            move = (tile, info.Direction(direction), length)
+            target = self.targets[i]
+            if length <= 2:
+                self.man_moves[tile].append(move)
+                self.crossing_men[target].add(tile)
+            else:
+                self.crossing_kings[target].add(tile)
+            self.all_moves[tile].append(move)
+            self.move_id[move] = i
+            self.id_move[i] = move
+            # every move on a ray shares the range of ids, ordered by length
+            ray = range(*rays[i].tolist())
+            self.rays.append(ray)
+            self.paths.append(tuple(self.targets[ray.start:i]))
+            if length == 1:
+                self.tile_rays[tile].append((move[1], info.is_up(direction), ray))
 
     def moves(self, tile, man=False):
         return self.man_moves[tile] if man else self.all_moves[tile]
@@ -50,6 +67,12 @@ class Moves:
     def target(self, move_id):
         return self.targets[move_id]
 
+    def path(self, move_id):
+        return self.paths[move_id]
+
+    def ray(self, move_id):
+        return self.rays[move_id]
+
     def move_id(self, move):
         return self.move_id.get(move)
 
@@ -57,3 +80,15 @@ class Moves:
         for tile in self.all_moves:
             for move in tile:
                 yield move
+
+
+# one shared instance per board size
+__by_size = {}
+
+
+def for_size(size):
+    if size not in __by_size:
+        moves = Moves()
+        moves.update_if_needed(size)
+        __by_size[size] = moves
+    return __by_size[size]
@@ -1,7 +1,14 @@
+import torch
 import torch.nn as nn
 import torch.nn.functional as functional
 
 
+def greedy_action(net, state, legal_mask):
+    with torch.no_grad():
+        out = net(torch.tensor(state, dtype=torch.float32).unsqueeze(0))[0]
+    return int(out.masked_fill(~torch.from_numpy(legal_mask), float('-inf')).argmax())
+
+
 class Network(nn.Module):
 
     def __init__(self, n_observations, n_actions):
@@ -10,6 +17,8 @@ class Network(nn.Module):
         self.layer1 = nn.Linear(n_observations, 128)
         self.layer2 = nn.Linear(128, 128)
         self.layer3 = nn.Linear(128, n_actions)
+        # value of the position for the side to move, used by MCTS at the leaves; Learn does not train it yet
+        self.value = nn.Linear(128, 1)
 
     # Called with either one element to determine next action, or a batch
     # during optimization. Returns tensor([[left0exp,right0exp]...]).
@@ -17,3 +26,9 @@ class Network(nn.Module):
         x = functional.relu(self.layer1(x))
         x = functional.relu(self.layer2(x))
         return self.layer3(x)
+
+    # Action outputs and value in [-1, 1] concatenated into one row per state.
+    def evaluate(self, x):
+        x = functional.relu(self.layer1(x))
+        x = functional.relu(self.layer2(x))
+        return torch.cat((self.layer3(x), torch.tanh(self.value(x))), dim=-1)
@@ -0,0 +1,129 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from Game import Game, possible_moves
+from Search import Search
+
+magic = b"CHKOB001"
+version = 1
+
+
+class OpeningBook:
+
+    def __init__(self, max_plies=16):
+        self.max_plies = max_plies
+        # (position hash, move id): [games, score], score counts 1 for a win and 0.5 for a draw of the mover
+        self.stats = {}
+        self.keys = np.zeros((0,), dtype=np.uint64)
+        self.counts = np.zeros((0,), dtype=np.uint32)
+        self.scores = np.zeros((0,), dtype=np.float32)
+        self.move_ids = np.zeros((0,), dtype=np.uint16)
+        self.hits = 0
+
+    @staticmethod
+    def load(path):
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        if data[:len(magic)].tobytes() != magic:
+            raise Exception("Not an opening book file!")
+        file_version, n_entries, max_plies = (int(field) for field in np.frombuffer(
+            data[len(magic):len(magic) + 3 * 8].tobytes(), dtype=np.int64))
+        if file_version != version:
+            raise Exception("Unsupported opening book version {}!".format(file_version))
+        book = OpeningBook(max_plies)
+        # columns in order of decreasing alignment: keys, counts, scores, move ids
+        offset = len(magic) + 3 * 8
+        for name, dtype in (("keys", np.uint64), ("counts", np.uint32), ("scores", np.float32), ("move_ids", np.uint16)):
+            size = n_entries * np.dtype(dtype).itemsize
+            setattr(book, name, data[offset:offset + size].view(np.ndarray).view(dtype))
+            offset += size
+        if offset != len(data):
+            raise Exception("Opening book file has wrong size!")
+        return book
+
+    def save(self, path):
+        entries = sorted(self.stats.items())
+        keys = np.array([key for (key, _), _ in entries], dtype=np.uint64)
+        move_ids = np.array([move_id for (_, move_id), _ in entries], dtype=np.uint16)
+        counts = np.array([games for _, (games, _) in entries], dtype=np.uint32)
+        scores = np.array([score for _, (_, score) in entries], dtype=np.float32)
+        with open(path, "wb") as file:
+            file.write(magic)
+            file.write(np.array([version, len(entries), self.max_plies], dtype=np.int64).tobytes())
+            for column in (keys, counts, scores, move_ids):
+                file.write(column.tobytes())
+
+    def add_game(self, move_ids, winner_side):
+        game = Game()
+        for move_id in move_ids:
+            if game.ply >= self.max_plies:
+                break
+            mover = int(game.game_state[-2])
+            entry = self.stats.setdefault((game.hash, int(move_id)), [0, 0.])
+            entry[0] += 1
+            entry[1] += 1. if winner_side == mover else 0.5 if winner_side == 0 else 0.
+            if not game.make(move_id):
+                raise Exception("Illegal move in opening book game!")
+
+    def moves(self, key):
+        # (move ids, games, scores) stored for a position hash
+        key = np.uint64(key)
+        start = np.searchsorted(self.keys, key, side="left")
+        stop = np.searchsorted(self.keys, key, side="right")
+        return self.move_ids[start:stop], self.counts[start:stop], self.scores[start:stop]
+
+    def choose(self, game, rng=None, min_games=1):
+        # best scoring book move, or one drawn in proportion to how often it was played when rng is given
+        if game.ply >= self.max_plies:
+            return None
+        move_ids, counts, scores = self.moves(game.hash)
+        known = counts >= min_games
+        if not known.any():
+            return None
+        move_ids, counts, scores = move_ids[known], counts[known], scores[known]
+        if rng is not None:
+            move_id = int(rng.choice(move_ids, p=counts / counts.sum()))
+        else:
+            move_id = int(move_ids[np.argmax(scores / counts)])
+        if not game.legal_mask[move_id]:
+            return None
+        self.hits += 1
+        return move_id
+
+    def __len__(self):
+        return len(self.keys) if not self.stats else len(self.stats)
+
+
+def play_game(search, rng, depth=3, random_plies=6, max_plies=200):
+    # engine game with random opening moves for variety, returns (move ids, winner side)
+    game = Game()
+    move_ids = []
+    while not game.done and len(move_ids) < max_plies and not game.check_game_end():
+        if len(move_ids) < random_plies:
+            move_id = int(rng.choice(game.legal_ids))
+        else:
+            move_id = possible_moves.move_id[search.search(game, max_depth=depth)]
+        game.make(move_id)
+        move_ids.append(move_id)
+    return move_ids, game.winner_side
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build an opening book from engine self-play games")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--plies", type=int, default=16)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "openings.bin"))
+    args = parser.parse_args()
+
+    book = OpeningBook(args.plies)
+    search = Search(1 << 16)
+    rng = np.random.default_rng(args.seed)
+    start = time.perf_counter()
+    for i in range(args.games):
+        book.add_game(*play_game(search, rng, args.depth))
+    book.save(args.output)
+    print("{} games, {} entries, {:.1f}s".format(args.games, len(book), time.perf_counter() - start))
@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from Game import Game
+from info import GameParams, Side
+
+pieces_symbols = {".": 0, "b": -1, "B": -2, "w": 1, "W": 2}
+
+# name: (position, depth), rows from the top separated by "/", side to move last
+positions = {
+    "start": ("bbbb/bbbb/bbbb/..../..../wwww/wwww/wwww w", 5),
+    "multi_capture": ("..../.b../..b./.b../..../b.b./.w../.... w", 8),
+    "capture_into_promotion": ("..../b.b./..../.b.b/..w./..../..../.... w", 8),
+    "flying_kings": ("B.../..b./..../.b../..../w.b./.W../.... w", 5),
+    "king_endgame": ("...B/..../..../..b./.w../..../..W./.... b", 5),
+    "crowded_middle": ("bbb./b.bb/.b.b/bb../.ww./w.ww/ww.w/wwww b", 5),
+}
+
+
+def position(notation):
+    tiles, active_side = notation.split()
+    tiles = tiles.replace("/", "")
+    game_state = np.zeros((len(tiles) + len(GameParams),), dtype=np.int8)
+    game_state[:len(tiles)] = [pieces_symbols[symbol] for symbol in tiles]
+    game_state[-3] = -1
+    game_state[-2] = Side.WHITE if active_side == "w" else Side.BLACK
+    return game_state
+
+
+def perft(game, depth):
+    if depth == 0:
+        return 1
+    nodes = 0
+    for move_id in game.legal_ids:
+        if not game.make(move_id):
+            continue
+        nodes += perft(game, depth - 1)
+        game.unmake()
+    return nodes
+
+
+def run(names=None, bitboard=False, max_depth=None, repeat=1):
+    # the fastest of repeat runs, which is the least disturbed by other load on the machine
+    results = {}
+    for name in names or positions:
+        notation, depth = positions[name]
+        if max_depth is not None:
+            depth = min(depth, max_depth)
+        game = Game(bitboard=bitboard)
+        game.set_state(position(notation))
+        seconds = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            nodes = perft(game, depth)
+            elapsed = time.perf_counter() - start
+            seconds = elapsed if seconds is None else min(seconds, elapsed)
+        results[name] = {"depth": depth, "nodes": nodes, "seconds": seconds, "nps": nodes / seconds}
+    return results
+
+
+def compare(results, baseline, tolerance=0.8):
+    ok = True
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None or expected["depth"] != result["depth"]:
+            status = "NO BASELINE"
+        elif expected["nodes"] != result["nodes"]:
+            status = "WRONG COUNT (expected {})".format(expected["nodes"])
+            ok = False
+        else:
+            ratio = result["nps"] / expected["nps"]
+            status = "{:.2f}x baseline speed".format(ratio)
+            if ratio < tolerance:
+                status += " SLOWER"
+                ok = False
+        print("{:<33} depth {} nodes {:>10} {:>10.0f} nodes/s  {}".format(
+            name, result["depth"], result["nodes"], result["nps"], status))
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Perft correctness and speed benchmark for Game move generation")
+    parser.add_argument("--baseline", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "perft_baseline.json"))
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--bitboard", action="store_true")
+    parser.add_argument("--depth", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=3, help="times each position is run, the fastest counts")
+    parser.add_argument("--tolerance", type=float, default=0.8, help="fails below this fraction of the baseline speed")
+    parser.add_argument("positions", nargs="*")
+    args = parser.parse_args()
+
+    results = run(args.positions, bitboard=args.bitboard, max_depth=args.depth, repeat=args.repeat)
+    # each backend has its own baseline entries
+    if args.bitboard:
+        results = {"bitboard/" + name: result for name, result in results.items()}
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    ok = compare(results, baseline, args.tolerance)
+    if args.update_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump({**baseline, **results}, file, indent=2)
+            file.write("\n")
+    sys.exit(0 if ok else 1)
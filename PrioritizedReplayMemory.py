@@ -0,0 +1,78 @@
+from collections import namedtuple
+
+import numpy as np
+import torch
+
+from ReplayMemory import ReplayMemory
+
+PrioritizedTransition = namedtuple("PrioritizedTransition",
+                                   ("state", "action", "next_state", "reward", "done", "weight", "index"))
+
+
+class PrioritizedReplayMemory(ReplayMemory):
+
+    def __init__(self, capacity, observation_size=35, seed=None, augment=False, alpha=0.6, beta=0.4, epsilon=1e-3,
+                 **kwargs):
+        super().__init__(capacity, observation_size, seed, augment, **kwargs)
+        self.alpha = alpha
+        # importance sampling correction, raised towards 1 while training
+        self.beta = beta
+        self.epsilon = epsilon
+        # sum tree over priority ** alpha: node i holds the sum of nodes 2i and 2i+1, leaves start at self.leaves
+        self.leaves = 1 << max(capacity - 1, 1).bit_length()
+        self.depth = self.leaves.bit_length() - 1
+        self.tree = self.buffer("priorities", (2 * self.leaves,), np.float64)
+        self.max_priority = 1.
+
+    def push_batch(self, states, actions, next_states, rewards, dones):
+        # slots written by the base class, which keeps only the last capacity transitions of a batch
+        n = min(len(actions), self.capacity)
+        indices = (self.position + np.arange(n)) % self.capacity
+        super().push_batch(states, actions, next_states, rewards, dones)
+        # new transitions are sampled at least once before their error is known
+        self.__set(indices, np.full((n,), self.max_priority))
+
+    def sample(self, batch_size):
+        # one draw from each of batch_size equal slices of the total priority, walking down the tree for all at once
+        total = self.tree[1]
+        targets = (np.arange(batch_size) + self.rng.random(batch_size)) * (total / batch_size)
+        nodes = np.ones((batch_size,), dtype=np.int64)
+        for _ in range(self.depth):
+            nodes <<= 1
+            left = self.tree[nodes]
+            right = targets >= left
+            targets -= left * right
+            nodes += right
+        # rounding can step past the last stored transition
+        indices = np.minimum(nodes - self.leaves, self.size - 1)
+        probabilities = self.tree[indices + self.leaves] / total
+        weights = (self.size * np.maximum(probabilities, 1e-12)) ** -self.beta
+        weights /= weights.max()
+        batch = self.gather(indices)
+        return PrioritizedTransition(*batch, torch.from_numpy(weights.astype(np.float32)), indices)
+
+    def update_priorities(self, indices, errors):
+        priorities = (np.abs(np.asarray(errors, dtype=np.float64)) + self.epsilon) ** self.alpha
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.__set(np.asarray(indices), priorities)
+
+    def state_dict(self):
+        return {**super().state_dict(), "max_priority": self.max_priority}
+
+    def load_state_dict(self, state):
+        super().load_state_dict(state)
+        self.max_priority = state.get("max_priority", 1.)
+        if self.size > 0 and self.tree[1] == 0:
+            # buffer written without priorities
+            self.__set(np.arange(self.size), np.full((self.size,), self.max_priority))
+
+    def __set(self, indices, priorities):
+        self.tree[indices + self.leaves] = priorities
+        # parents are summed again from their children, so repeated indices in a batch are harmless;
+        # halving a sorted array keeps it sorted, so dropping repeats on every level only compares neighbours
+        nodes = np.unique((indices + self.leaves) >> 1)
+        for _ in range(self.depth):
+            self.tree[nodes] = self.tree[nodes << 1] + self.tree[(nodes << 1) | 1]
+            nodes >>= 1
+            if len(nodes) > 1:
+                nodes = nodes[np.concatenate(([True], nodes[1:] != nodes[:-1]))]
@@ -1,20 +1,122 @@
-import random
-from collections import namedtuple, deque
+import os
+from collections import namedtuple
 
-Transition = namedtuple("Transition", ("state", "action", "next_state", "reward"))
+import numpy as np
+import torch
+
+from Game import possible_moves
+from canonical import canonical_actions, flip_states
+
+Transition = namedtuple("Transition", ("state", "action", "next_state", "reward", "done"))
 
 
 class ReplayMemory:
 
-    def __init__(self, capacity):
-        self.memory = deque([], maxlen=capacity)
+    def __init__(self, capacity, observation_size=35, seed=None, augment=False, moves=possible_moves, path=None):
+        self.capacity = capacity
+        # sample each transition as stored or rotated with colours swapped, for states that are not canonical
+        self.augment = augment
+        self.moves = moves
+        # with a path the buffer lives in memory-mapped .npy files in that directory, see flush
+        self.path = path
+        self.__maps = []
+        self.states = self.buffer("states", (capacity, observation_size), np.int8)
+        self.next_states = self.buffer("next_states", (capacity, observation_size), np.int8)
+        self.actions = self.buffer("actions", (capacity,), np.int16)
+        self.rewards = self.buffer("rewards", (capacity,), np.float32)
+        self.dones = self.buffer("dones", (capacity,), bool)
+        self.position = 0
+        self.size = 0
+        self.rng = np.random.default_rng(seed)
+        self.batch_size = 0
+
+    def buffer(self, name, shape, dtype):
+        # an array of the memory, memory-mapped when it has a path
+        if self.path is None:
+            return np.zeros(shape, dtype=dtype)
+        os.makedirs(self.path, exist_ok=True)
+        file = os.path.join(self.path, name + ".npy")
+        if os.path.exists(file):
+            array = np.lib.format.open_memmap(file, mode="r+")
+            if array.shape != shape or array.dtype != dtype:
+                raise Exception("Replay buffer file {} does not match the capacity or observation size!".format(file))
+        else:
+            array = np.lib.format.open_memmap(file, mode="w+", dtype=dtype, shape=shape)
+        self.__maps.append(array)
+        # plain arrays over the same pages, indexing a memmap goes through slower python code
+        return array.view(np.ndarray)
+
+    def flush(self):
+        # writes only the pages changed since the last flush
+        for array in self.__maps:
+            array.flush()
+
+    def state_dict(self):
+        return {"position": self.position, "size": self.size, "rng": self.rng.bit_generator.state}
 
-    def push(self, *args):
-        self.memory.append(Transition(*args))
+    def load_state_dict(self, state):
+        self.position = state["position"]
+        self.size = state["size"]
+        self.rng.bit_generator.state = state["rng"]
+
+    def push(self, state, action, next_state, reward):
+        done = next_state is None
+        self.push_batch(np.asarray(state).reshape(1, -1), np.asarray(action).reshape(1),
+                        np.zeros_like(self.states[:1]) if done else np.asarray(next_state).reshape(1, -1),
+                        np.asarray(reward).reshape(1), np.array([done]))
+
+    def push_batch(self, states, actions, next_states, rewards, dones):
+        n = len(actions)
+        if n > self.capacity:
+            states, actions, next_states, rewards, dones = (
+                array[-self.capacity:] for array in (states, actions, next_states, rewards, dones))
+            n = self.capacity
+        # write in at most two slices, wrapping around the end of the buffer
+        first = min(n, self.capacity - self.position)
+        for start, stop, offset in ((self.position, self.position + first, 0), (0, n - first, first)):
+            if stop <= start:
+                continue
+            count = stop - start
+            self.states[start:stop] = states[offset:offset + count]
+            self.next_states[start:stop] = next_states[offset:offset + count]
+            self.actions[start:stop] = actions[offset:offset + count]
+            self.rewards[start:stop] = rewards[offset:offset + count]
+            self.dones[start:stop] = dones[offset:offset + count]
+        self.position = (self.position + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
 
     def sample(self, batch_size):
-        return random.sample(self.memory, batch_size)
+        # returned tensors share buffers that are overwritten by the next call
+        indices = self.rng.integers(0, self.size, size=batch_size)
+        return self.gather(indices)
+
+    def gather(self, indices):
+        if len(indices) != self.batch_size:
+            self.__allocate_batch(len(indices))
+        np.take(self.states, indices, axis=0, out=self.__states)
+        np.take(self.next_states, indices, axis=0, out=self.__next_states)
+        actions = self.actions[indices]
+        if self.augment:
+            flip = self.rng.random(len(indices)) < 0.5
+            self.__states[flip] = flip_states(self.__states[flip])
+            self.__next_states[flip] = flip_states(self.__next_states[flip])
+            actions = canonical_actions(actions, flip, self.moves)
+        np.copyto(self.__batch.state.numpy(), self.__states)
+        np.copyto(self.__batch.next_state.numpy(), self.__next_states)
+        np.copyto(self.__batch.action.numpy()[:, 0], actions)
+        np.take(self.rewards, indices, out=self.__batch.reward.numpy())
+        np.take(self.dones, indices, out=self.__batch.done.numpy())
+        return self.__batch
+
+    def __allocate_batch(self, batch_size):
+        self.batch_size = batch_size
+        self.__states = np.zeros((batch_size, self.states.shape[1]), dtype=np.int8)
+        self.__next_states = np.zeros_like(self.__states)
+        self.__batch = Transition(torch.zeros((batch_size, self.states.shape[1])),
+                                  torch.zeros((batch_size, 1), dtype=torch.long),
+                                  torch.zeros((batch_size, self.states.shape[1])),
+                                  torch.zeros((batch_size,)),
+                                  torch.zeros((batch_size,), dtype=torch.bool))
 
     def __len__(self):
-        return len(self.memory)
-    
\ No newline at end of file
+        return self.size
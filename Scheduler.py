@@ -0,0 +1,101 @@
+import copy
+import threading
+from itertools import count
+
+import numpy as np
+import torch
+
+
+class Scheduler:
+
+    def __init__(self, learn, env_steps_per_update=1.0, max_lead=64, sync_every=1):
+        self.learn = learn
+        self.env_steps_per_update = env_steps_per_update
+        self.max_lead = max_lead
+        self.sync_every = sync_every
+        # acting uses its own copy of the policy, refreshed every sync_every gradient steps
+        self.actor_net = copy.deepcopy(learn.policy_net)
+        self.actor_lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.env_steps = 0
+        self.updates = 0
+        self.stopped = False
+        self.__error = None
+
+    def run(self, n_updates):
+        self.stopped = False
+        self.__error = None
+        actor = threading.Thread(target=self.__act, daemon=True)
+        self.learn.open_metrics()
+        actor.start()
+        try:
+            for _ in range(n_updates):
+                with self.condition:
+                    # learning waits until enough new environment steps have been played
+                    self.condition.wait_for(lambda: self.stopped or (
+                        len(self.learn.memory) >= self.learn.BATCH_SIZE
+                        and self.env_steps >= (self.updates + 1) * self.env_steps_per_update))
+                    if self.stopped:
+                        break
+                self.learn.optimize_model()
+                self.learn.update_target()
+                with self.condition:
+                    self.updates += 1
+                    self.condition.notify_all()
+                if self.updates % self.sync_every == 0:
+                    self.__sync()
+        finally:
+            self.stop()
+            actor.join()
+            self.learn.close_metrics()
+            self.learn.close_checkpoints()
+        if self.__error is not None:
+            raise self.__error
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def __sync(self):
+        with self.actor_lock, torch.no_grad():
+            for actor, policy in zip(self.actor_net.parameters(), self.learn.policy_net.parameters()):
+                actor.copy_(policy)
+
+    def __act(self):
+        try:
+            self.__play()
+        except Exception as exception:
+            # raised by run, which would otherwise wait for steps that never come
+            self.__error = exception
+        finally:
+            self.stop()
+
+    def __play(self):
+        learn = self.learn
+        env = learn.env
+        while not self.stopped:
+            state, _ = env.reset()
+            state = np.array(state)
+            episode_reward = 0
+            for t in count(1):
+                with self.condition:
+                    # acting may run ahead of learning by at most max_lead gradient steps
+                    self.condition.wait_for(lambda: self.stopped or len(learn.memory) < learn.BATCH_SIZE
+                                            or self.env_steps < (self.updates + self.max_lead) * self.env_steps_per_update)
+                    if self.stopped:
+                        return
+                with self.actor_lock:
+                    action = learn.select_action(torch.tensor(state, dtype=torch.float32, device=learn.device).unsqueeze(0),
+                                                 legal_mask=env.legal_mask(), net=self.actor_net)
+                observation, reward, terminated, truncated, _ = env.step(action.item())
+                with learn.memory_lock:
+                    learn.memory.push(state, action.item(), None if terminated else observation, reward)
+                episode_reward += reward
+                state = np.array(observation)
+                with self.condition:
+                    self.env_steps += 1
+                    self.condition.notify_all()
+                if terminated or truncated:
+                    learn.end_episode(t, episode_reward)
+                    break
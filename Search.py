@@ -0,0 +1,215 @@
+import time
+
+from Game import possible_moves
+from canonical import move_permutation
+
+MATE = 100000
+INFINITY = 10 * MATE
+# tablebase wins rank below any win found by the search itself
+TABLEBASE_WIN = MATE // 2
+
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+
+class Search:
+
+    def __init__(self, tt_size=1 << 20, max_ply=128, tablebase=None, book=None):
+        self.man_value = 100
+        self.king_value = 300
+        self.advance_value = 3
+        self.tt_size = tt_size
+        self.tt_mask = tt_size - 1
+        if tt_size & self.tt_mask:
+            raise Exception("Transposition table size must be a power of 2!")
+        # entry: (key, generation, depth, flag, score, move id)
+        self.tt = [None] * tt_size
+        self.generation = 0
+        self.max_ply = max_ply
+        self.tablebase = tablebase
+        self.book = book
+        self.killers = [[-1, -1] for _ in range(max_ply + 1)]
+        self.history = [0] * possible_moves.n_moves
+        self.move_flip = []
+        self.nodes = 0
+        self.node_limit = None
+        self.deadline = None
+        self.stopped = False
+        self.best_move = None
+        self.best_score = 0
+        self.depth_reached = 0
+        self.__root_move = -1
+
+    def search(self, game, max_depth=64, time_limit=None, node_limit=None):
+        self.nodes = 0
+        self.node_limit = node_limit
+        self.deadline = None if time_limit is None else time.perf_counter() + time_limit
+        self.stopped = False
+        self.generation += 1
+        self.killers = [[-1, -1] for _ in range(self.max_ply + 1)]
+        moves = game.moves
+        if len(self.history) != moves.n_moves:
+            # sized for the board of the game being searched
+            self.history = [0] * moves.n_moves
+        if len(self.move_flip) != moves.n_moves:
+            self.move_flip = move_permutation(moves).tolist()
+        self.history = [value // 2 for value in self.history]
+        self.best_move = None
+        self.best_score = 0
+        self.depth_reached = 0
+        if game.done or len(game.legal_moves) == 0:
+            return None
+        if len(game.legal_moves) == 1:
+            self.best_move = game.legal_moves[0]
+            return self.best_move
+        book_move = None if self.book is None else self.book.choose(game)
+        if book_move is not None:
+            self.best_move = moves.move(book_move)
+            return self.best_move
+        for depth in range(1, max_depth + 1):
+            score = self.__negamax(game, depth, -INFINITY, INFINITY, 0)
+            if self.stopped:
+                break
+            self.best_score = score
+            self.best_move = moves.move(self.__root_move)
+            self.depth_reached = depth
+            if abs(score) >= MATE - self.max_ply:
+                break
+        if self.best_move is None:
+            # budget ran out during the first iteration
+            self.best_move = moves.move(self.__order(game, 0, -1)[0])
+        return self.best_move
+
+    def stop(self):
+        self.stopped = True
+
+    def evaluate(self, game):
+        half = game.half
+        score = 0
+        for tile, piece in enumerate(game.game_state[:game.n_tiles].tolist()):
+            if piece == 0:
+                continue
+            if piece == 2 or piece == -2:
+                value = self.king_value
+            elif piece > 0:
+                value = self.man_value + self.advance_value * (game.size - 1 - tile // half)
+            else:
+                value = self.man_value + self.advance_value * (tile // half)
+            score += value if piece > 0 else -value
+        return score if game.game_state[-2] > 0 else -score
+
+    def __check_budget(self):
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            self.stopped = True
+        elif self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.stopped = True
+
+    def __order(self, game, ply, tt_move):
+        killers = self.killers[ply]
+        scored = []
+        for move_id in game.legal_ids:
+            enemy_tile = game.takes[move_id]
+            if move_id == tt_move:
+                score = 4 * INFINITY
+            elif enemy_tile != -1:
+                score = 3 * INFINITY + abs(int(game.game_state[enemy_tile]))
+            elif move_id in killers:
+                score = 2 * INFINITY - killers.index(move_id)
+            else:
+                score = self.history[move_id]
+            scored.append((score, move_id))
+        scored.sort(reverse=True)
+        return [move_id for _, move_id in scored]
+
+    def __negamax(self, game, depth, alpha, beta, ply):
+        self.nodes += 1
+        # a node takes about 0.15 ms, so the clock is read every 32 nodes and the node limit is exact
+        if self.nodes & 31 == 0 or self.nodes == self.node_limit:
+            self.__check_budget()
+        if self.stopped:
+            return 0
+        if game.done:
+            return 0 if game.winner_side == 0 else -MATE + ply
+        if game.game_state[-1] > game.max_moves_without_taking:
+            return 0
+        if self.tablebase is not None and ply > 0:
+            result = self.tablebase.probe(game.game_state)
+            if result is not None:
+                value, distance = result
+                return value * (TABLEBASE_WIN - distance)
+        capturing = game.takes[game.legal_mask].max() != -1
+        # quiescence: past the horizon only forced captures are followed
+        if (depth <= 0 and not capturing) or ply >= self.max_ply:
+            return self.evaluate(game)
+
+        # positions and their colour swapped twins share entries, moves are stored for the white to move form
+        key = game.canonical_hash()
+        flip = game.game_state[-2] != 1
+        index = key & self.tt_mask
+        entry = self.tt[index]
+        tt_move = -1
+        if entry is not None and entry[0] == key:
+            tt_move = entry[5]
+            if flip and tt_move != -1:
+                tt_move = self.move_flip[tt_move]
+            if entry[2] >= depth and ply > 0:
+                score = self.__score_from_tt(entry[4], ply)
+                if entry[3] == EXACT or (entry[3] == LOWER and score >= beta) or (entry[3] == UPPER and score <= alpha):
+                    return score
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = -1
+        for move_id in self.__order(game, ply, tt_move):
+            active_side = game.game_state[-2]
+            game.make(move_id)
+            if game.game_state[-2] == active_side:
+                # the same piece keeps taking, which does not use up depth
+                score = self.__negamax(game, depth, alpha, beta, ply + 1)
+            else:
+                score = -self.__negamax(game, depth - 1, -beta, -alpha, ply + 1)
+            game.unmake()
+            if self.stopped:
+                return 0
+            if score > best_score:
+                best_score = score
+                best_move = move_id
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if game.takes[move_id] == -1:
+                    killers = self.killers[ply]
+                    if killers[0] != move_id:
+                        killers[1] = killers[0]
+                        killers[0] = move_id
+                    self.history[move_id] += depth * depth
+                break
+
+        if best_score <= original_alpha:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        # depth-preferred replacement, entries from older searches are always replaced
+        if entry is None or entry[1] != self.generation or depth >= entry[2]:
+            stored_move = self.move_flip[best_move] if flip and best_move != -1 else best_move
+            self.tt[index] = (key, self.generation, depth, flag, self.__score_to_tt(best_score, ply), stored_move)
+        if ply == 0:
+            self.__root_move = best_move
+        return best_score
+
+    def __score_to_tt(self, score, ply):
+        if score >= MATE - self.max_ply:
+            return score + ply
+        if score <= -MATE + self.max_ply:
+            return score - ply
+        return score
+
+    def __score_from_tt(self, score, ply):
+        if score >= MATE - self.max_ply:
+            return score - ply
+        if score <= -MATE + self.max_ply:
+            return score + ply
+        return score
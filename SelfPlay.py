@@ -0,0 +1,191 @@
+import math
+import os
+import queue
+import threading
+import time
+import traceback
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from GameArchive import ArchiveWriter
+from GameEnv import GameEnv
+from canonical import canonical_actions
+from InferenceBroker import InferenceBroker
+from Network import Network, greedy_action
+from OpeningBook import OpeningBook
+from Tablebase import Tablebase
+
+
+def play_episode(env, policy, eps_threshold, rng, book_move=None):
+    state, _ = env.reset()
+    states, actions, next_states, rewards, dones = [], [], [], [], []
+    while True:
+        # book moves come before exploration, random moves start once the book runs out
+        action = book_move() if book_move is not None else None
+        if action is None and rng.random() > eps_threshold(len(actions)):
+            action = policy(state, env.legal_mask())
+        elif action is None:
+            action = rng.choice(np.flatnonzero(env.legal_mask()))
+        states.append(np.array(state, dtype=np.int8))
+        state, reward, terminated, truncated, _ = env.step(action)
+        actions.append(action)
+        next_states.append(np.array(state, dtype=np.int8))
+        rewards.append(reward)
+        dones.append(terminated)
+        if terminated or truncated:
+            break
+    return np.stack(states), np.array(actions), np.stack(next_states), np.array(rewards, dtype=np.float32), np.array(dones)
+
+
+def worker(seed, shared_net, version, lock, transitions, stop, eps, games_per_worker=1, tablebase_path=None,
+           book_path=None, canonical=False, archive_dir=None, size=8):
+    torch.set_num_threads(1)
+    tablebase = Tablebase.load(tablebase_path) if tablebase_path else None
+    book = OpeningBook.load(book_path) if book_path else None
+    # every worker appends to its own shards
+    archive = ArchiveWriter(archive_dir, "worker-{}".format(seed), size=size) if archive_dir else None
+    net = Network(shared_net.layer1.in_features, shared_net.layer3.out_features)
+    # several games on threads share one batched forward pass per step
+    broker = InferenceBroker(net, batch_size=games_per_worker).start() if games_per_worker > 1 else None
+    if broker is None:
+        policy = lambda state, legal_mask: greedy_action(net, state, legal_mask)
+        weights_lock = threading.Lock()
+    else:
+        policy = broker.select_action
+        weights_lock = broker.lock
+    local_version = [-1]
+    steps_done = [0]
+    eps_start, eps_end, eps_decay = eps
+
+    def play(game_seed):
+        try:
+            play_games(game_seed)
+        except Exception:
+            # passed on to the learner, which raises it instead of waiting for episodes that never come
+            transitions.put(Exception("Self-play worker {} failed:\n{}".format(seed, traceback.format_exc())))
+
+    def play_games(game_seed):
+        rng = np.random.default_rng(game_seed)
+        env = GameEnv(size=size, tablebase=tablebase, canonical=canonical)
+
+        # book moves are drawn by how often they were played so openings keep some variety
+        def choose_book_move():
+            move_id = book.choose(env.game, rng)
+            if move_id is not None and canonical:
+                move_id = int(canonical_actions(move_id, env.game.active_side() != 1, env.game.moves))
+            return move_id
+
+        book_move = choose_book_move if book is not None else None
+        while not stop.is_set():
+            if version.value != local_version[0]:
+                with weights_lock, lock:
+                    net.load_state_dict(shared_net.state_dict())
+                    local_version[0] = version.value
+            steps = steps_done[0]
+            episode = play_episode(env, policy, lambda t: eps_end + (eps_start - eps_end) * math.exp(-1. * (steps + t) / eps_decay),
+                                   rng, book_move)
+            steps_done[0] += len(episode[1])
+            if archive is not None:
+                archive.write(env.game.move_ids(), env.winner_side)
+            while not stop.is_set():
+                try:
+                    transitions.put(episode, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+    games = [threading.Thread(target=play, args=(seed * games_per_worker + i,)) for i in range(games_per_worker)]
+    for game in games:
+        game.start()
+    for game in games:
+        game.join()
+    if broker is not None:
+        broker.stop()
+    if archive is not None:
+        archive.close()
+
+
+class SelfPlay:
+
+    def __init__(self, policy_net, n_workers=None, eps=(0.9, 0.05, 1000), queue_size=256, seed=0, games_per_worker=1,
+                 tablebase_path=None, book_path=None, canonical=False, archive_dir=None, size=8):
+        self.context = mp.get_context("spawn")
+        self.n_workers = n_workers or os.cpu_count()
+        self.games_per_worker = games_per_worker
+        self.tablebase_path = tablebase_path
+        self.book_path = book_path
+        self.canonical = canonical
+        self.archive_dir = archive_dir
+        self.size = size
+        self.eps = eps
+        self.seed = seed
+        self.shared_net = Network(policy_net.layer1.in_features, policy_net.layer3.out_features)
+        self.shared_net.load_state_dict(policy_net.state_dict())
+        self.shared_net.share_memory()
+        self.version = self.context.Value("i", 0)
+        self.lock = self.context.Lock()
+        self.transitions = self.context.Queue(maxsize=queue_size)
+        self.stop_event = self.context.Event()
+        self.workers = []
+        self.episodes = 0
+
+    def start(self):
+        for i in range(self.n_workers):
+            process = self.context.Process(target=worker, daemon=True, args=(
+                self.seed + i, self.shared_net, self.version, self.lock, self.transitions, self.stop_event, self.eps,
+                self.games_per_worker, self.tablebase_path, self.book_path, self.canonical,
+                self.archive_dir, self.size))
+            process.start()
+            self.workers.append(process)
+
+    def sync(self, policy_net):
+        with self.lock:
+            self.shared_net.load_state_dict(policy_net.state_dict())
+            self.version.value += 1
+
+    def episodes_ready(self, block=False, timeout=None):
+        # raises what a worker failed with, or once no worker is left to play while waiting
+        episodes = self.__drain(block, timeout)
+        for episode in episodes:
+            if isinstance(episode, Exception):
+                raise episode
+        if not episodes and self.workers and not any(process.is_alive() for process in self.workers):
+            raise Exception("All self-play workers exited, exit codes {}!".format(
+                [process.exitcode for process in self.workers]))
+        self.episodes += len(episodes)
+        return episodes
+
+    def __drain(self, block=False, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        episodes = []
+        # polled so dead workers are noticed while blocking
+        while block and not episodes:
+            wait = 0.1 if deadline is None else min(0.1, deadline - time.monotonic())
+            if wait <= 0:
+                break
+            try:
+                episodes.append(self.transitions.get(timeout=wait))
+            except queue.Empty:
+                if self.workers and not any(process.is_alive() for process in self.workers):
+                    break
+        try:
+            while True:
+                episodes.append(self.transitions.get_nowait())
+        except queue.Empty:
+            pass
+        return episodes
+
+    def stop(self):
+        self.stop_event.set()
+        # workers only exit once their queued episodes are flushed
+        for process in self.workers:
+            for _ in range(50):
+                self.__drain()
+                process.join(timeout=0.1)
+                if not process.is_alive():
+                    break
+            if process.is_alive():
+                process.terminate()
+        self.workers = []
@@ -0,0 +1,244 @@
+import argparse
+import itertools
+import math
+import os
+import time
+
+import numpy as np
+
+from Game import Game, possible_moves
+from info import GameParams, Side
+
+magic = b"CHKTB001"
+version = 1
+
+WIN = 1
+DRAW = 0
+LOSS = -1
+
+# entry byte: value in the top 2 bits (0 draw or not a position, 1 win, 2 loss), distance in the low 6 bits
+value_codes = {WIN: 1, LOSS: 2}
+code_values = {0: DRAW, 1: WIN, 2: LOSS, 3: DRAW}
+
+
+class Tablebase:
+
+    def __init__(self, max_pieces=3, n_tiles=32, max_moves_without_taking=39, data=None):
+        self.max_pieces = max_pieces
+        self.n_tiles = n_tiles
+        self.half = int(math.sqrt(n_tiles * 2) / 2)
+        self.limit = max_moves_without_taking + 1
+        if self.limit > 63:
+            raise Exception("No-capture limit does not fit in the distance bits!")
+        self.comb = [[math.comb(n, k) for k in range(max_pieces + 1)] for n in range(n_tiles + 1)]
+        # (white pieces, black pieces): (offset, size), smaller slices first
+        self.slices = {}
+        offset = 0
+        for total in range(2, max_pieces + 1):
+            for n_white in range(1, total):
+                n_black = total - n_white
+                size = self.comb[n_tiles][n_white] * self.comb[n_tiles][n_black] * (1 << total) * 2
+                self.slices[(n_white, n_black)] = (offset, size)
+                offset += size
+        self.data = np.zeros((offset,), dtype=np.uint8) if data is None else data
+        self.hits = 0
+
+    @staticmethod
+    def load(path):
+        header = np.memmap(path, dtype=np.uint8, mode="r")
+        if header[:len(magic)].tobytes() != magic:
+            raise Exception("Not a tablebase file!")
+        fields = np.frombuffer(header[len(magic):len(magic) + 5 * 8].tobytes(), dtype=np.int64)
+        file_version, n_tiles, max_pieces, limit, n_slices = (int(field) for field in fields)
+        if file_version != version:
+            raise Exception("Unsupported tablebase version {}!".format(file_version))
+        start = len(magic) + (5 + 4 * n_slices) * 8
+        tablebase = Tablebase(max_pieces, n_tiles, limit - 1, data=header[start:])
+        if len(tablebase.data) != sum(size for _, size in tablebase.slices.values()):
+            raise Exception("Tablebase file is truncated!")
+        return tablebase
+
+    def save(self, path):
+        fields = [version, self.n_tiles, self.max_pieces, self.limit, len(self.slices)]
+        for (n_white, n_black), (offset, size) in self.slices.items():
+            fields += [n_white, n_black, offset, size]
+        with open(path, "wb") as file:
+            file.write(magic)
+            file.write(np.array(fields, dtype=np.int64).tobytes())
+            file.write(np.asarray(self.data).tobytes())
+
+    def index(self, game_state):
+        # (slice, index inside the slice) of a position between turns, None if it is not covered
+        if game_state[-3] != -1 or len(game_state) != self.n_tiles + len(GameParams):
+            return None
+        white = []
+        black = []
+        kings = 0
+        pieces = game_state[:self.n_tiles].tolist()
+        for tile, piece in enumerate(pieces):
+            if piece > 0:
+                white.append(tile)
+            elif piece < 0:
+                black.append(tile)
+        n_white = len(white)
+        n_black = len(black)
+        key = (n_white, n_black)
+        if key not in self.slices:
+            return None
+        comb = self.comb
+        white_rank = 0
+        for i, tile in enumerate(white):
+            white_rank += comb[tile][i + 1]
+        black_rank = 0
+        for i, tile in enumerate(black):
+            black_rank += comb[tile][i + 1]
+        for tile in white + black:
+            kings = kings << 1 | (pieces[tile] == 2 or pieces[tile] == -2)
+        index = ((white_rank * comb[self.n_tiles][n_black] + black_rank) << (n_white + n_black)) | kings
+        return key, index << 1 | (game_state[-2] == Side.BLACK)
+
+    def probe(self, game_state):
+        # (value for the side to move, distance) or None; distance is the number of moves without taking the
+        # winner needs, so the result only holds while moves without taking + distance stays within the limit
+        position = self.index(game_state)
+        if position is None:
+            return None
+        key, index = position
+        entry = int(self.data[self.slices[key][0] + index])
+        value = code_values[entry >> 6]
+        distance = entry & 0x3f
+        if value != DRAW and distance > 0 and int(game_state[-1]) + distance > self.limit:
+            value = DRAW
+        self.hits += 1
+        return value, distance
+
+    def build(self, verbose=False):
+        for key in self.slices:
+            start = time.perf_counter()
+            self.__build_slice(key)
+            if verbose:
+                offset, size = self.slices[key]
+                values = self.data[offset:offset + size] >> 6
+                print("slice {}v{}: {} entries, {} wins, {} losses, {:.1f}s".format(
+                    key[0], key[1], size, np.count_nonzero(values == 1), np.count_nonzero(values == 2),
+                    time.perf_counter() - start))
+
+    def __positions(self, n_white, n_black):
+        n_pieces = n_white + n_black
+        game_state = np.zeros((self.n_tiles + len(GameParams),), dtype=np.int8)
+        game_state[GameParams.ACTIVE_PIECE] = -1
+        top = range(self.half)
+        bottom = range(self.n_tiles - self.half, self.n_tiles)
+        for white in itertools.combinations(range(self.n_tiles), n_white):
+            for black in itertools.combinations(range(self.n_tiles), n_black):
+                if set(white) & set(black):
+                    continue
+                tiles = white + black
+                for kings in range(1 << n_pieces):
+                    is_king = [kings >> (n_pieces - 1 - i) & 1 for i in range(n_pieces)]
+                    # men on their promotion row cannot appear between turns
+                    if any(not is_king[i] and tile in top for i, tile in enumerate(white)) \
+                            or any(not is_king[n_white + i] and tile in bottom for i, tile in enumerate(black)):
+                        continue
+                    game_state[:self.n_tiles] = 0
+                    for i, tile in enumerate(tiles):
+                        game_state[tile] = (1 + is_king[i]) * (1 if i < n_white else -1)
+                    for active_side in (Side.WHITE, Side.BLACK):
+                        game_state[GameParams.ACTIVE_SIDE] = active_side
+                        yield game_state
+
+    def __turns(self, game, mover):
+        # positions at the end of every complete turn, following multi-captures to the end
+        for move_id in list(game.legal_ids):
+            if not game.make(move_id):
+                continue
+            if game.game_state[GameParams.ACTIVE_SIDE] == mover and not game.done:
+                yield from self.__turns(game, mover)
+            else:
+                yield game
+            game.unmake()
+
+    def __quiet_child(self, game_state, move_id):
+        # same as Game.make for a move without taking, which always ends the turn
+        child = game_state.copy()
+        target = possible_moves.targets[move_id]
+        piece = child[possible_moves.sources[move_id]]
+        child[possible_moves.sources[move_id]] = 0
+        if piece == 1 and target < self.half:
+            piece = 2
+        elif piece == -1 and target >= self.n_tiles - self.half:
+            piece = -2
+        child[target] = piece
+        child[-2] = -child[-2]
+        return child
+
+    def __value(self, game):
+        # exact result at zero moves without taking for the side to move, used after captures
+        if game.done or game.pieces_left[int(game.game_state[GameParams.ACTIVE_SIDE])] == 0:
+            return LOSS
+        key, index = self.index(game.game_state)
+        return code_values[int(self.data[self.slices[key][0] + index]) >> 6]
+
+    def __build_slice(self, key):
+        offset, size = self.slices[key]
+        game = Game()
+        game.max_moves_without_taking = self.limit - 1
+        # per position: -2 not a position, -1 no moves, 0 quiet moves, 1 captures
+        kind = np.full((size,), -2, dtype=np.int8)
+        capture_value = np.zeros((size,), dtype=np.int8)
+        quiet = []
+        children = []
+        starts = []
+        for game_state in self.__positions(*key):
+            _, index = self.index(game_state)
+            game.set_state(game_state)
+            if game.done:
+                kind[index] = -1
+                continue
+            mover = game.game_state[GameParams.ACTIVE_SIDE]
+            if game.takes[game.legal_ids[0]] != -1:
+                kind[index] = 1
+                capture_value[index] = max(-self.__value(child) for child in self.__turns(game, mover))
+                continue
+            kind[index] = 0
+            quiet.append(index)
+            starts.append(len(children))
+            for move_id in game.legal_ids:
+                children.append(self.index(self.__quiet_child(game_state, move_id))[1])
+        quiet = np.array(quiet, dtype=np.int64)
+        children = np.array(children, dtype=np.int64)
+        starts = np.array(starts, dtype=np.int64)
+
+        # value iteration over the moves without taking counter, from the draw limit down to 0
+        values = np.where(kind == -1, LOSS, DRAW).astype(np.int8)
+        decided = np.full((size,), -1, dtype=np.int16)
+        decided[kind == -1] = self.limit
+        captures = kind == 1
+        for counter in range(self.limit - 1, -1, -1):
+            new_values = values.copy()
+            new_values[captures] = capture_value[captures]
+            if len(quiet):
+                new_values[quiet] = np.maximum.reduceat(-values[children], starts)
+            changed = (decided != -1) & (new_values != values)
+            if changed.any():
+                raise Exception("Tablebase value changed after it was decided!")
+            newly = (decided == -1) & (new_values != DRAW)
+            decided[newly] = counter
+            values = new_values
+
+        codes = np.zeros((size,), dtype=np.uint8)
+        codes[values == WIN] = value_codes[WIN] << 6
+        codes[values == LOSS] = value_codes[LOSS] << 6
+        distance = np.where(decided == -1, 0, self.limit - decided).astype(np.uint8)
+        self.data[offset:offset + size] = codes | distance
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build an endgame tablebase by retrograde analysis")
+    parser.add_argument("--pieces", type=int, default=3)
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebase.bin"))
+    args = parser.parse_args()
+
+    tablebase = Tablebase(args.pieces)
+    tablebase.build(verbose=True)
+    tablebase.save(args.output)
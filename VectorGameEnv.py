@@ -0,0 +1,120 @@
+import numpy as np
+from gymnasium import spaces
+
+import board
+from Game import Game
+from info import Edge, is_up
+
+
+class VectorGameEnv:
+
+    def __init__(self, n_envs, size=8):
+        self.n_envs = n_envs
+        self.size = size
+        start = Game(size)
+        self.n_tiles = start.n_tiles
+        self.max_moves_without_taking = start.max_moves_without_taking
+        self.start_state = start.game_state.astype(np.int8)
+        self.start_mask = start.legal_mask.copy()
+        possible_moves = start.moves
+        self.n_moves = possible_moves.n_moves
+        self.observation_space = spaces.Box(-2, self.n_tiles, shape=(n_envs, len(self.start_state)), dtype=np.int8)
+        self.action_space = spaces.MultiDiscrete([self.n_moves] * n_envs)
+
+        self.sources = np.array([possible_moves.move(move_id)[0] for move_id in range(self.n_moves)])
+        self.targets = np.array(possible_moves.targets[:self.n_moves])
+        self.lengths = np.array([possible_moves.move(move_id)[2] for move_id in range(self.n_moves)])
+        self.forward = np.array([is_up(possible_moves.move(move_id)[1]) for move_id in range(self.n_moves)])
+        # intermediate tiles of every move, padded with an always empty extra tile
+        max_path = max(len(path) for path in possible_moves.paths[:self.n_moves])
+        self.paths = np.full((self.n_moves, max(max_path, 1)), self.n_tiles)
+        for move_id in range(self.n_moves):
+            path = possible_moves.path(move_id)
+            self.paths[move_id, :len(path)] = path
+        self.promotion_rows = np.zeros((2, self.n_tiles), dtype=bool)
+        for tile in range(self.n_tiles):
+            self.promotion_rows[0, tile] = board.on_edge(size, tile, Edge.BOTTOM_EDGE)
+            self.promotion_rows[1, tile] = board.on_edge(size, tile, Edge.TOP_EDGE)
+
+        self.states = np.tile(self.start_state, (n_envs, 1))
+        self.legal_mask = np.tile(self.start_mask, (n_envs, 1))
+
+    def reset(self, seed=None, options=None):
+        self.states[:] = self.start_state
+        self.legal_mask[:] = self.start_mask
+        return self.states, {"legal_mask": self.legal_mask}
+
+    def __legal(self, states):
+        active_side = states[:, -2:-1]
+        active_piece = states[:, -3:-2]
+        pieces = np.zeros((len(states), self.n_tiles + 1), dtype=np.int8)
+        pieces[:, :self.n_tiles] = states[:, :self.n_tiles] * active_side
+        # relative to the side to move: positive own pieces, negative enemy pieces
+        moving = pieces[:, self.sources]
+        in_path = pieces[:, self.paths]
+        enemies = (in_path < 0).sum(axis=2)
+        takes = enemies == 1
+        legal = (moving > 0) & ~(in_path > 0).any(axis=2) & (enemies < 2) & (pieces[:, self.targets] == 0)
+        man = moving == 1
+        legal &= ~man | (self.lengths <= 2)
+        legal &= ~man | (self.lengths != 1) | (self.forward == (active_side > 0))
+        legal &= ~man | (self.lengths != 2) | takes
+        legal &= (active_piece == -1) | ((self.sources == active_piece) & takes)
+        take_possible = (legal & takes).any(axis=1, keepdims=True)
+        return legal & (takes | ~take_possible)
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        games = np.arange(self.n_envs)
+        rewards = np.zeros((self.n_envs,), dtype=np.float32)
+        valid = self.legal_mask[games, actions]
+        rewards[~valid] = -1
+
+        moved = games[valid]
+        actions = actions[valid]
+        states = self.states
+        sources = self.sources[actions]
+        targets = self.targets[actions]
+        pieces = states[moved, sources]
+        states[moved, sources] = 0
+        states[moved, targets] = pieces
+
+        padded = np.zeros((len(moved), self.n_tiles + 1), dtype=np.int8)
+        padded[:, :self.n_tiles] = states[moved, :self.n_tiles]
+        path = self.paths[actions]
+        occupied = padded[np.arange(len(moved))[:, None], path] != 0
+        took = occupied.any(axis=1)
+        taken = path[np.arange(len(moved)), occupied.argmax(axis=1)]
+        states[moved[took], taken[took]] = 0
+        states[moved, -1] = np.where(took, 0, states[moved, -1] + 1)
+
+        # a piece that took keeps moving while it can take again, otherwise the turn passes
+        states[moved, -3] = targets
+        continuing = np.zeros((len(moved),), dtype=bool)
+        if took.any():
+            legal = self.__legal(states[moved[took]])
+            continuing[took] = legal.any(axis=1)
+            self.legal_mask[moved[continuing]] = legal[continuing[took]]
+        ended = moved[~continuing]
+        states[ended, -2] *= -1
+        states[ended, -3] = -1
+        self.legal_mask[ended] = self.__legal(states[ended])
+
+        # promotion happens after legal moves are found, as in Game.perform_move
+        promoted = self.promotion_rows[(pieces > 0).astype(int), targets] & (np.abs(pieces) == 1)
+        states[moved[promoted], targets[promoted]] = pieces[promoted] * 2
+
+        lost = ~self.legal_mask[moved].any(axis=1)
+        rewards[moved[lost]] = 1
+        terminated = ~valid
+        terminated[moved] = lost | (states[moved, -1] > self.max_moves_without_taking)
+
+        infos = {"legal_mask": self.legal_mask}
+        if terminated.any():
+            infos["final_observation"] = states[terminated].copy()
+            states[terminated] = self.start_state
+            self.legal_mask[terminated] = self.start_mask
+        return states, rewards, terminated, np.zeros_like(terminated), infos
+
+    def close(self):
+        pass
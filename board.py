@@ -1,12 +1,10 @@
 import math
+import os
 
 import numpy as np
 
 from info import Edge, Direction
 
-size = 8
-n_tiles = 32
-
 edges_to_check = [
     [Edge.TOP_EDGE, Edge.LEFT_EDGE],
     [Edge.TOP_EDGE, Edge.RIGHT_EDGE],
@@ -30,20 +28,93 @@ def __on_edge(size, tile, edge):
             raise Exception("Wrong edge given!")
     
 
-on_edges = np.zeros(shape=(n_tiles, 4), dtype=bool)
-for tile in range(n_tiles):
-    for edge in range(4):
-        on_edges[tile, edge] = __on_edge(size, tile, edge)
+# generated tables are cached on disk per board size and memory-mapped, bump the version when their layout changes
+tables_version = 1
+tables_dir = os.environ.get("CHECKERS_TABLES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tables"))
+table_names = ("on_edges", "neighs", "moves", "targets", "rays")
+__tables = {}
+
+
+def tables(size=8):
+    # (on_edges, neighs) indexed by [tile, edge] and [tile, direction], -1 for no neighbour
+    arrays = __load(size)
+    return arrays["on_edges"], arrays["neighs"]
+
+
+def move_tables(size=8):
+    # (moves, targets, rays) indexed by move id: (tile, direction, length), target tile, [first, last + 1) ids of its ray
+    arrays = __load(size)
+    return arrays["moves"], arrays["targets"], arrays["rays"]
+
+
+def __load(size):
+    if size not in __tables:
+        paths = {name: os.path.join(tables_dir, "board-v{}-{}-{}.npy".format(tables_version, size, name))
+                 for name in table_names}
+        if all(os.path.exists(path) for path in paths.values()):
+            arrays = {name: np.load(path, mmap_mode="r").view(np.ndarray) for name, path in paths.items()}
+        else:
+            arrays = __build(size)
+            __save(arrays, paths)
+        __tables[size] = arrays
+    return __tables[size]
+
+
+def __save(arrays, paths):
+    # written under a temporary name and renamed so workers starting together never read a partial file
+    try:
+        os.makedirs(tables_dir, exist_ok=True)
+        for name, path in paths.items():
+            temporary = "{}.{}.tmp".format(path, os.getpid())
+            with open(temporary, "wb") as file:
+                np.save(file, arrays[name])
+            os.replace(temporary, path)
+    except OSError:
+        pass  # read-only install, the tables are rebuilt by every process
+
+
+def __build(size):
+    n_tiles = size * size // 2
+    on_edges = np.zeros(shape=(n_tiles, 4), dtype=bool)
+    for tile in range(n_tiles):
+        for edge in range(4):
+            on_edges[tile, edge] = __on_edge(size, tile, edge)
+    neighs = np.full(shape=(n_tiles, 4), fill_value=-1, dtype=np.int16)
+    for tile in range(n_tiles):
+        for direction in range(4):
+            neigh = __get_neigh(size, tile, direction)
+            if neigh is not None:
+                neighs[tile, direction] = neigh
+    # move ids are ordered by tile, direction and length
+    moves = []
+    targets = []
+    rays = []
+    for tile in range(n_tiles):
+        for direction in range(4):
+            ray_start = len(moves)
+            neigh = neighs[tile, direction]
+            while neigh != -1:
+                moves.append((tile, direction, len(moves) - ray_start + 1))
+                targets.append(neigh)
+                neigh = neighs[neigh, direction]
+            rays.extend([(ray_start, len(moves))] * (len(moves) - ray_start))
+    return {
+        "on_edges": on_edges,
+        "neighs": neighs,
+        "moves": np.array(moves, dtype=np.int16).reshape(-1, 3),
+        "targets": np.array(targets, dtype=np.int16),
+        "rays": np.array(rays, dtype=np.int16).reshape(-1, 2),
+    }
 
 
 def on_edge(size, tile, edge):
-    return on_edges[tile, edge]
+    return tables(size)[0][tile, edge]
 
 
 def __get_neigh(size, tile, direction):
     half = int(size / 2)
     for edge in edges_to_check[direction]:
-        if on_edge(size, tile, edge):
+        if __on_edge(size, tile, edge):
             return None
     odd_row = int(tile % size >= half)
     match direction:
@@ -59,16 +130,6 @@ def __get_neigh(size, tile, direction):
             raise Exception("Wrong direction given!")
 
 
-neighs = np.zeros(shape=(n_tiles, 4), dtype=int)
-for tile in range(n_tiles):
-    for direction in range(4):
-        neigh = __get_neigh(size, tile, direction)
-        if neigh is None:
-            neighs[tile, direction] = -1
-        else:
-            neighs[tile, direction] = neigh
-
-
 def get_neigh(size, tile, direction):
-    neigh = neighs[tile, direction]
-    return None if neigh == -1 else neigh
+    neigh = tables(size)[1][tile, direction]
+    return None if neigh == -1 else int(neigh)
@@ -0,0 +1,60 @@
+import numpy as np
+
+from info import GameParams, Side, opposed_direction
+
+# positions are symmetric under a 180 degree rotation of the board combined with swapping colours;
+# the canonical form of a position is the one with white to move
+
+__tile_permutations = {}
+__move_permutations = {}
+
+
+def tile_permutation(n_tiles):
+    if n_tiles not in __tile_permutations:
+        __tile_permutations[n_tiles] = np.arange(n_tiles - 1, -1, -1)
+    return __tile_permutations[n_tiles]
+
+
+def move_permutation(moves):
+    # the permutation is its own inverse
+    if moves.size not in __move_permutations:
+        n_tiles = len(moves.all_moves)
+        permutation = np.zeros((moves.n_moves,), dtype=np.int64)
+        for move_id in range(moves.n_moves):
+            tile, direction, length = moves.move(move_id)
+            permutation[move_id] = moves.move_id[(n_tiles - 1 - tile, opposed_direction(direction), length)]
+        __move_permutations[moves.size] = permutation
+    return __move_permutations[moves.size]
+
+
+def flip_states(states):
+    # works on a single game_state or a batch of them stacked along the first axis
+    states = np.asarray(states)
+    n_tiles = states.shape[-1] - len(GameParams)
+    flipped = states.copy()
+    flipped[..., :n_tiles] = -states[..., n_tiles - 1::-1]
+    active = states[..., GameParams.ACTIVE_PIECE]
+    flipped[..., GameParams.ACTIVE_PIECE] = np.where(active == -1, -1, n_tiles - 1 - active)
+    flipped[..., GameParams.ACTIVE_SIDE] = -states[..., GameParams.ACTIVE_SIDE]
+    return flipped
+
+
+def to_flip(states):
+    return np.asarray(states)[..., GameParams.ACTIVE_SIDE] == Side.BLACK
+
+
+def canonical_states(states):
+    states = np.asarray(states)
+    flip = to_flip(states)
+    return np.where(flip[..., None], flip_states(states), states)
+
+
+def canonical_actions(actions, flip, moves):
+    # maps actions between a position and its canonical form, in either direction
+    actions = np.asarray(actions)
+    return np.where(flip, move_permutation(moves)[actions], actions)
+
+
+def canonical_masks(masks, flip, moves):
+    masks = np.asarray(masks)
+    return np.where(np.asarray(flip)[..., None], masks[..., move_permutation(moves)], masks)
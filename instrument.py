@@ -0,0 +1,154 @@
+import argparse
+import functools
+import importlib
+import json
+import threading
+import time
+
+# (module, class, attribute, timer name); wrapped only while instrumentation is enabled so it costs nothing when off
+targets = [
+    ("Game", "Game", "_Game__update_legal", "game.update_legal"),
+    ("Game", "Game", "check_move", "game.check_move"),
+    ("Game", "Game", "perform_move", "game.perform_move"),
+    ("Game", "Game", "make", "game.make"),
+    ("Game", "Game", "undo_move", "game.undo_move"),
+    ("Game", "Game", "unmake", "game.unmake"),
+    ("GameEnv", "GameEnv", "step", "env.step"),
+    ("VectorGameEnv", "VectorGameEnv", "step", "vector_env.step"),
+    ("Learn", "Learn", "select_action", "learn.select_action"),
+    ("Learn", "Learn", "optimize_model", "learn.optimize_model"),
+    ("Learn", "Learn", "update_target", "learn.update_target"),
+    ("ReplayMemory", "ReplayMemory", "sample", "replay.sample"),
+    ("PrioritizedReplayMemory", "PrioritizedReplayMemory", "sample", "replay.sample"),
+    ("PrioritizedReplayMemory", "PrioritizedReplayMemory", "update_priorities", "replay.update_priorities"),
+]
+
+# report name: (timer, what one call counts as)
+throughputs = {
+    "env_steps_per_s": ("env.step", 1),
+    "gradient_steps_per_s": ("learn.optimize_model", 1),
+    "positions_per_s": ("game.make", 1),
+}
+
+enabled = False
+counters = {}
+# name: [calls, seconds]
+timers = {}
+started = None
+stopped = None
+__originals = []
+__dumper = None
+__stop = threading.Event()
+
+
+def enable(dump_path=None, dump_every=10.0, modules=None):
+    global enabled, started, stopped, __dumper
+    if enabled:
+        return
+    for module_name, class_name, attribute, name in targets:
+        if modules is not None and module_name not in modules:
+            continue
+        owner = getattr(importlib.import_module(module_name), class_name)
+        original = owner.__dict__[attribute]
+        __originals.append((owner, attribute, original))
+        setattr(owner, attribute, __timed(name, original))
+    started = time.perf_counter()
+    stopped = None
+    enabled = True
+    if dump_path is not None:
+        __stop.clear()
+        __dumper = threading.Thread(target=__dump_periodically, args=(dump_path, dump_every), daemon=True)
+        __dumper.start()
+
+
+def disable():
+    global enabled, stopped, __dumper
+    if not enabled:
+        return
+    enabled = False
+    stopped = time.perf_counter()
+    for owner, attribute, original in reversed(__originals):
+        setattr(owner, attribute, original)
+    __originals.clear()
+    if __dumper is not None:
+        __stop.set()
+        __dumper.join()
+        __dumper = None
+
+
+def reset():
+    global started, stopped
+    counters.clear()
+    for timer in timers.values():
+        timer[0] = 0
+        timer[1] = 0.
+    started = time.perf_counter()
+    stopped = None if enabled else started
+
+
+def count(name, n=1):
+    if enabled:
+        counters[name] = counters.get(name, 0) + n
+
+
+def __timed(name, function):
+    timer = timers.setdefault(name, [0, 0.])
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timer[0] += 1
+            timer[1] += time.perf_counter() - start
+    return wrapper
+
+
+def snapshot():
+    elapsed = (stopped or time.perf_counter()) - started if started is not None else 0.
+    report = {
+        "time": time.time(),
+        "elapsed": elapsed,
+        "counters": dict(counters),
+        "timers": {name: {"calls": calls, "seconds": seconds, "us_per_call": seconds / calls * 1e6 if calls else 0.}
+                   for name, (calls, seconds) in timers.items() if calls},
+    }
+    for name, (timer, per_call) in throughputs.items():
+        calls = timers.get(timer, (0, 0.))[0]
+        report[name] = calls * per_call / elapsed if elapsed > 0 else 0.
+    return report
+
+
+def dump(path):
+    with open(path, "a") as file:
+        file.write(json.dumps(snapshot()) + "\n")
+
+
+def __dump_periodically(path, every):
+    while not __stop.wait(every):
+        dump(path)
+    dump(path)
+
+
+def format_report(report):
+    lines = ["{:.1f}s: {:.0f} env steps/s, {:.1f} gradient steps/s, {:.0f} positions/s".format(
+        report["elapsed"], report["env_steps_per_s"], report["gradient_steps_per_s"], report["positions_per_s"])]
+    for name, timer in sorted(report["timers"].items(), key=lambda item: -item[1]["seconds"]):
+        lines.append("  {:<24} {:>10} calls {:>9.3f}s {:>10.1f} us/call".format(
+            name, timer["calls"], timer["seconds"], timer["us_per_call"]))
+    for name, value in sorted(report["counters"].items()):
+        lines.append("  {:<24} {:>10}".format(name, value))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the reports from an instrumentation JSONL dump")
+    parser.add_argument("path")
+    parser.add_argument("--all", action="store_true", help="every snapshot instead of only the last one")
+    args = parser.parse_args()
+
+    with open(args.path) as file:
+        reports = [json.loads(line) for line in file if line.strip()]
+    for report in reports if args.all else reports[-1:]:
+        print(format_report(report))
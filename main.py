@@ -1,5 +1,20 @@
+import argparse
+
+from EnginePlayer import EnginePlayer
 from GameMaster import GameMaster
+from Search import Search
+from info import Side
 
 if __name__ == "__main__":
-    g = GameMaster()
+    parser = argparse.ArgumentParser(description="Play checkers")
+    parser.add_argument("--engine", choices=["none", "search"], default="none")
+    parser.add_argument("--engine-side", choices=["white", "black"], default="black")
+    parser.add_argument("--think-time", type=float, default=1.0)
+    parser.add_argument("--no-ponder", action="store_true")
+    args = parser.parse_args()
+
+    engine = None
+    if args.engine == "search":
+        engine = EnginePlayer(Search(), think_time=args.think_time, ponder=not args.no_ponder)
+    g = GameMaster(engine, Side.WHITE if args.engine_side == "white" else Side.BLACK)
     g.new_game()
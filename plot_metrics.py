@@ -0,0 +1,57 @@
+import argparse
+import csv
+import json
+import os
+
+import numpy as np
+
+
+def read_rows(path):
+    with open(path) as file:
+        if path.endswith(".csv"):
+            return [{key: float(value) for key, value in row.items()} for row in csv.DictReader(file)]
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def rolling_mean(values, window):
+    if len(values) < window:
+        return None
+    means = np.convolve(values, np.ones(window) / window, mode="valid")
+    return np.concatenate((np.zeros(window - 1), means))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plot the metrics written during training")
+    parser.add_argument("metrics_dir")
+    parser.add_argument("--format", default="jsonl")
+    parser.add_argument("--window", type=int, default=100)
+    parser.add_argument("--output", default=None, help="image to save instead of showing a window")
+    args = parser.parse_args()
+
+    import matplotlib
+    if args.output is not None:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    figure, (durations_axis, loss_axis) = plt.subplots(2, 1, figsize=(8, 8))
+    episodes = read_rows(os.path.join(args.metrics_dir, "episodes." + args.format))
+    durations = np.array([row["duration"] for row in episodes], dtype=float)
+    durations_axis.plot(durations)
+    means = rolling_mean(durations, args.window)
+    if means is not None:
+        durations_axis.plot(means)
+    durations_axis.set_xlabel("Episode")
+    durations_axis.set_ylabel("Duration")
+
+    steps_path = os.path.join(args.metrics_dir, "steps." + args.format)
+    if os.path.exists(steps_path):
+        steps = read_rows(steps_path)
+        loss_axis.plot([row["update"] for row in steps], [row["loss"] for row in steps])
+    loss_axis.set_xlabel("Update")
+    loss_axis.set_ylabel("Loss")
+
+    figure.tight_layout()
+    if args.output is not None:
+        figure.savefig(args.output)
+    else:
+        plt.show()
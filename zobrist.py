@@ -0,0 +1,73 @@
+import numpy as np
+
+from info import Side
+
+seed = 2137
+mask = (1 << 64) - 1
+
+__tables = {}
+__paired_tables = {}
+
+
+def tables(n_tiles):
+    # pieces[tile][piece + 2], side key for black to move, active[active_piece + 1]; empty tile and no active piece hash to 0
+    if n_tiles not in __tables:
+        rng = np.random.default_rng(seed + n_tiles)
+        keys = [int(key) for key in rng.integers(0, np.iinfo(np.uint64).max, size=n_tiles * 4 + 1 + n_tiles, dtype=np.uint64, endpoint=True)]
+        pieces = [[keys[tile * 4], keys[tile * 4 + 1], 0, keys[tile * 4 + 2], keys[tile * 4 + 3]] for tile in range(n_tiles)]
+        side = keys[n_tiles * 4]
+        active = [0] + keys[n_tiles * 4 + 1:]
+        __tables[n_tiles] = pieces, side, active
+    return __tables[n_tiles]
+
+
+def full_hash(game_state, n_tiles):
+    pieces, side, active = tables(n_tiles)
+    key = 0
+    for tile, piece in enumerate(game_state[:n_tiles].tolist()):
+        key ^= pieces[tile][int(piece) + 2]
+    if game_state[-2] == Side.BLACK:
+        key ^= side
+    return key ^ active[int(game_state[-3]) + 1]
+
+
+def mirrored_tables(n_tiles):
+    # keys that hash a position as if the board was rotated and the colours swapped, see canonical
+    pieces, side, active = tables(n_tiles)
+    mirrored_pieces = [[pieces[n_tiles - 1 - tile][4 - piece] for piece in range(5)] for tile in range(n_tiles)]
+    mirrored_active = [0] + active[:0:-1]
+    return mirrored_pieces, side, mirrored_active
+
+
+def mirrored_hash(game_state, n_tiles):
+    pieces, side, active = mirrored_tables(n_tiles)
+    key = 0
+    for tile, piece in enumerate(game_state[:n_tiles].tolist()):
+        key ^= pieces[tile][int(piece) + 2]
+    if game_state[-2] == Side.WHITE:
+        key ^= side
+    return key ^ active[int(game_state[-3]) + 1]
+
+
+def paired_tables(n_tiles):
+    # both keys in one int, hash in the low and mirrored hash in the high 64 bits
+    if n_tiles not in __paired_tables:
+        pieces, side, active = tables(n_tiles)
+        mirrored_pieces, _, mirrored_active = mirrored_tables(n_tiles)
+        paired_pieces = [[key | mirrored << 64 for key, mirrored in zip(tile, mirrored_tile)]
+                         for tile, mirrored_tile in zip(pieces, mirrored_pieces)]
+        paired_active = [key | mirrored << 64 for key, mirrored in zip(active, mirrored_active)]
+        __paired_tables[n_tiles] = paired_pieces, side | side << 64, paired_active
+    return __paired_tables[n_tiles]
+
+
+def paired_hash(game_state, n_tiles):
+    # full_hash | mirrored_hash << 64 in one pass over the occupied tiles
+    pieces, side, active = paired_tables(n_tiles)
+    key = 0
+    board = game_state[:n_tiles]
+    for tile, piece in zip(np.flatnonzero(board).tolist(), board[board != 0].tolist()):
+        key ^= pieces[tile][piece + 2]
+    # the side key goes into the half whose side to move is black
+    key ^= side & mask if game_state[-2] == Side.BLACK else side >> 64 << 64
+    return key ^ active[int(game_state[-3]) + 1]